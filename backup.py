@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PREFIX = "monkey_stars-"
+SNAPSHOT_SUFFIX = ".db"
+
+
+def file_checksum(path: str) -> str:
+    """SHA-256 файла, читается блоками"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _remove_partial(path: str):
+    for leftover in (path, path + "-journal"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+
+class BackupService:
+    """Снимки базы через VACUUM INTO.
+
+    Снимок пишется одной транзакцией чтения в отдельном потоке, поэтому
+    запись других процессов не перезапускает копирование (в отличие от
+    порционного онлайн-бэкапа), а цикл событий не блокируется. Копирование
+    прерывается по таймауту или при отмене задачи.
+    """
+
+    def __init__(
+        self,
+        db_path: str = Config.DB_PATH,
+        backup_dir: str = Config.BACKUP_DIR,
+        interval: int = Config.BACKUP_INTERVAL,
+        keep: int = Config.BACKUP_KEEP,
+        timeout: int = Config.BACKUP_TIMEOUT,
+    ):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.keep = keep
+        self.timeout = timeout
+        self._task = None
+
+    def list_snapshots(self):
+        """Снимки от старых к новым"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        names = sorted(
+            name for name in os.listdir(self.backup_dir)
+            if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+        )
+        return [os.path.join(self.backup_dir, name) for name in names]
+
+    async def _run_interruptible(self, func, *args):
+        """func(conn_factory, *args) в потоке; прерывание по таймауту или отмене"""
+        stop = threading.Event()
+        deadline = time.monotonic() + self.timeout
+
+        def connect(path: str) -> sqlite3.Connection:
+            conn = sqlite3.connect(path)
+            # Ненулевой ответ обработчика прерывает текущий запрос SQLite
+            conn.set_progress_handler(lambda: stop.is_set() or time.monotonic() > deadline, 10000)
+            return conn
+
+        future = asyncio.ensure_future(asyncio.to_thread(func, connect, *args))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Поток нельзя отменить извне: прерываем запрос и ждем,
+            # пока он закроет файлы, чтобы убрать недописанный снимок
+            stop.set()
+            try:
+                await future
+            except sqlite3.Error:
+                pass
+            raise
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                raise TimeoutError(f"Backup did not finish in {self.timeout} s") from e
+            raise
+
+    @staticmethod
+    def _vacuum_into(connect, source_path: str, target_path: str):
+        source = connect(source_path)
+        try:
+            source.execute("VACUUM INTO ?", (target_path,))
+        finally:
+            source.close()
+
+    @staticmethod
+    def _backup_to(connect, source_path: str, target_path: str):
+        source = connect(source_path)
+        target = connect(target_path)
+        try:
+            # Источник - неизменный снимок, копирование за один шаг
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    def _snapshot_path(self) -> str:
+        """Имя по времени с микросекундами: снимки сортируются по имени"""
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S-%f")
+        return os.path.join(self.backup_dir, f"{SNAPSHOT_PREFIX}{stamp}{SNAPSHOT_SUFFIX}")
+
+    async def snapshot(self):
+        """Новый снимок; None, если база не изменилась с прошлого снимка"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        path = self._snapshot_path()
+        tmp_path = path + ".tmp"
+        _remove_partial(tmp_path)
+
+        try:
+            await self._run_interruptible(self._vacuum_into, self.db_path, tmp_path)
+            if not await asyncio.to_thread(self._integrity_ok, tmp_path):
+                raise sqlite3.DatabaseError(f"integrity_check failed for {tmp_path}")
+            checksum = await asyncio.to_thread(file_checksum, tmp_path)
+
+            snapshots = self.list_snapshots()
+            if snapshots and self._read_checksum(snapshots[-1]) == checksum:
+                return None
+
+            # link, в отличие от replace, не перезаписывает существующий снимок
+            os.link(tmp_path, path)
+        finally:
+            _remove_partial(tmp_path)
+
+        with open(path + ".sha256", "w") as f:
+            f.write(checksum)
+
+        self.prune()
+        logger.info("Backup snapshot %s", path)
+        return path
+
+    def prune(self):
+        """Удаление снимков сверх лимита хранения"""
+        snapshots = self.list_snapshots()
+        for path in snapshots[:max(len(snapshots) - self.keep, 0)]:
+            os.remove(path)
+            if os.path.exists(path + ".sha256"):
+                os.remove(path + ".sha256")
+
+    @staticmethod
+    def _read_checksum(path: str):
+        try:
+            with open(path + ".sha256") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _integrity_ok(path: str) -> bool:
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+        finally:
+            conn.close()
+
+    async def verify(self, path: str) -> bool:
+        """Проверка контрольной суммы и целостности снимка"""
+        expected = self._read_checksum(path)
+        if expected is None:
+            return False
+        if await asyncio.to_thread(file_checksum, path) != expected:
+            return False
+        return await asyncio.to_thread(self._integrity_ok, path)
+
+    async def restore(self, path: str):
+        """Восстановление базы из снимка онлайн-бэкапом поверх DB_PATH"""
+        if not await self.verify(path):
+            raise ValueError(f"Snapshot {path} failed verification")
+        await self._run_interruptible(self._backup_to, path, self.db_path)
+        logger.info("Restored %s from %s", self.db_path, path)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.snapshot()
+            except Exception:
+                logger.exception("Backup snapshot failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def _cli(args):
+    service = BackupService()
+    if args.command == "snapshot":
+        path = await service.snapshot()
+        print(path or "No changes since last snapshot")
+    elif args.command == "list":
+        for path in service.list_snapshots():
+            print(path)
+    elif args.command == "verify":
+        print("ok" if await service.verify(args.path) else "FAILED")
+    elif args.command == "restore":
+        await service.restore(args.path)
+        print(f"Restored from {args.path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monkey Stars database backups")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("snapshot")
+    sub.add_parser("list")
+    sub.add_parser("verify").add_argument("path")
+    sub.add_parser("restore").add_argument("path")
+    asyncio.run(_cli(parser.parse_args()))
@@ -1,5 +1,6 @@
 import os
 from dotenv import load_dotenv
+from money import from_stars
 
 load_dotenv()
 
@@ -8,6 +9,11 @@ class Config:
     BOT_TOKEN = os.getenv("BOT_TOKEN")
     ADMIN_ID = 7973988177
     
+    # Исходящие сообщения (см. outbox.py)
+    OUTBOX_CHAT_INTERVAL = 1.0
+    OUTBOX_GLOBAL_RATE = 25
+    OUTBOX_CONCURRENCY = 8
+    
     # Web App
     WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
     WEB_PORT = int(os.getenv("WEB_PORT", 8080))
@@ -15,14 +21,60 @@ class Config:
     
     # Database
     DB_PATH = "monkey_stars.db"
+    # postgres://... - хранилище PostgreSQL (asyncpg) вместо файла SQLite
+    DATABASE_URL = os.getenv("DATABASE_URL")
+    PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", 2))
+    PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", 20))
+    
+    # Горячее состояние пользователей в памяти (см. user_state.py)
+    STATE_TTL = int(os.getenv("STATE_TTL", 60))
+    STATE_DIR = os.getenv("STATE_DIR", "state")
+    
+    # Backups
+    BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+    BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", 3600))
+    BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 24))
+    BACKUP_TIMEOUT = int(os.getenv("BACKUP_TIMEOUT", 600))
     
     # Game Settings
-    CLICK_REWARD = 0.2
+    # Суммы в милли-STAR (см. money.py)
+    CLICK_REWARD = from_stars("0.2")
     CLICK_COOLDOWN = 3600
-    REFERRAL_REWARD_REFERRER = 3.0
-    REFERRAL_REWARD_REFEREE = 2.0
+    REFERRAL_REWARD_REFERRER = from_stars(3)
+    REFERRAL_REWARD_REFEREE = from_stars(2)
     CLICK_REFERRAL_PERCENT = 10
     
+    # Push-события для веб-сессий (см. events.py)
+    EVENTS_QUEUE_SIZE = 100
+    EVENTS_SYNC_INTERVAL = float(os.getenv("EVENTS_SYNC_INTERVAL", 2))
+    EVENTS_KEEPALIVE = 15
+    
+    # Антифрод (см. fraud.py)
+    FRAUD = {
+        'window': 3600,
+        'referral_window': 86400,
+        'max_requests_per_minute': 60,
+        'min_games': 50,
+        'win_rate': 0.5,
+        'win_rate_z': 4.0,
+        'min_referrals': 10,
+        'min_active_referral_ratio': 0.2,
+        'max_users_per_ip': 20,
+        'ip_window': 3600,
+    }
+    
+    # Заголовок с IP клиента от доверенного прокси (X-Real-IP, X-Forwarded-For);
+    # пусто - адрес соединения
+    TRUSTED_IP_HEADER = os.getenv("TRUSTED_IP_HEADER", "")
+    
+    # Максимум ставок в одном пакетном запросе / авто-игре
+    GAMES_BATCH_MAX = 1000
+    
+    # Доказуемо честный ГСЧ (см. rng.py)
+    RNG_NONCE_RESERVE = 1000
+    RNG_BUFFER = 64
+    RNG_STREAMS_CACHE = 10000
+    
     # Games RTP
     GAMES = {
         'flip': {
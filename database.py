@@ -1,66 +1,187 @@
 import aiosqlite
 import time
 from config import Config
+from money import Money, MILLI_PER_STAR
+from storage import (
+    LedgerEvent, OPEN_WITHDRAWAL_STATUSES, OPEN_WITHDRAWALS_WHERE, StorageBackend, withdrawal_sources
+)
 
-class Database:
+SCHEMA_VERSION = 6
+
+SCHEMA_BY_TABLE = {
+    'users': '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            balance INTEGER DEFAULT 0,
+            referrer_id INTEGER DEFAULT NULL,
+            last_click INTEGER DEFAULT NULL,
+            created_at INTEGER DEFAULT (strftime('%s', 'now')),
+            referral_paid INTEGER DEFAULT 0
+        )
+    ''',
+    'sponsors': '''
+        CREATE TABLE IF NOT EXISTS sponsors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_username TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            channel_url TEXT NOT NULL
+        )
+    ''',
+    'user_sponsors': '''
+        CREATE TABLE IF NOT EXISTS user_sponsors (
+            user_id INTEGER,
+            sponsor_id INTEGER,
+            is_subscribed BOOLEAN DEFAULT 0,
+            PRIMARY KEY (user_id, sponsor_id)
+        )
+    ''',
+    'withdrawals': '''
+        CREATE TABLE IF NOT EXISTS withdrawals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount INTEGER,
+            status TEXT DEFAULT 'pending',
+            created_at INTEGER DEFAULT (strftime('%s', 'now')),
+            request_key TEXT,
+            priority INTEGER DEFAULT 0,
+            updated_at INTEGER
+        )
+    ''',
+    'transactions': '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount INTEGER,
+            type TEXT,
+            description TEXT,
+            created_at INTEGER DEFAULT (strftime('%s', 'now'))
+        )
+    ''',
+    'rng_seeds': '''
+        CREATE TABLE IF NOT EXISTS rng_seeds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            server_seed TEXT NOT NULL,
+            server_seed_hash TEXT NOT NULL,
+            client_seed TEXT NOT NULL,
+            nonce_reserved INTEGER DEFAULT 0,
+            active BOOLEAN DEFAULT 1,
+            created_at INTEGER DEFAULT (strftime('%s', 'now')),
+            revealed_at INTEGER
+        )
+    ''',
+    'user_flags': '''
+        CREATE TABLE IF NOT EXISTS user_flags (
+            user_id INTEGER PRIMARY KEY,
+            reason TEXT,
+            created_at INTEGER DEFAULT (strftime('%s', 'now'))
+        )
+    ''',
+}
+
+INDEXES = [
+    '''CREATE UNIQUE INDEX IF NOT EXISTS idx_withdrawals_request_key
+       ON withdrawals (request_key)''',
+    # Очередь открытых заявок читается по индексу без сортировки
+    '''DROP INDEX IF EXISTS idx_withdrawals_queue''',
+    f'''CREATE INDEX IF NOT EXISTS idx_withdrawals_open
+       ON withdrawals (priority DESC, id) WHERE {OPEN_WITHDRAWALS_WHERE}''',
+    '''CREATE UNIQUE INDEX IF NOT EXISTS idx_rng_seeds_active
+       ON rng_seeds (user_id) WHERE active''',
+]
+
+SCHEMA = list(SCHEMA_BY_TABLE.values()) + INDEXES
+
+# Колонки, добавленные после создания таблиц: (версия, таблица, колонка, определение)
+ADDED_COLUMNS = [
+    (3, 'withdrawals', 'request_key', 'TEXT'),
+    (3, 'withdrawals', 'priority', 'INTEGER DEFAULT 0'),
+    (3, 'withdrawals', 'updated_at', 'INTEGER'),
+    (5, 'users', 'referral_paid', 'INTEGER DEFAULT 0'),
+]
+
+# Таблицы с денежной колонкой: (таблица, колонки, денежная колонка).
+# Суммы хранятся в милли-STAR, см. money.py.
+MONEY_TABLES = [
+    ('users', ('user_id', 'username', 'balance', 'referrer_id', 'last_click', 'created_at'), 'balance'),
+    ('withdrawals', ('id', 'user_id', 'amount', 'status', 'created_at'), 'amount'),
+    ('transactions', ('id', 'user_id', 'amount', 'type', 'description', 'created_at'), 'amount'),
+]
+
+class Database(StorageBackend):
+    """Хранилище на SQLite (aiosqlite), один файл Config.DB_PATH"""
+    
     def __init__(self, db_path: str = Config.DB_PATH):
+        super().__init__()
         self.db_path = db_path
     
     async def init_db(self):
         """Инициализация базы данных"""
         async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    balance REAL DEFAULT 0.0,
-                    referrer_id INTEGER DEFAULT NULL,
-                    last_click INTEGER DEFAULT NULL,
-                    created_at INTEGER DEFAULT (strftime('%s', 'now'))
-                )
-            ''')
+            # WAL сохраняется в файле: читатели (в том числе снимки
+            # backup.py) не блокируют запись кликов и ставок
+            await db.execute("PRAGMA journal_mode=WAL")
             
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS sponsors (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    channel_username TEXT NOT NULL,
-                    channel_id TEXT NOT NULL,
-                    channel_url TEXT NOT NULL
-                )
-            ''')
+            cursor = await db.execute("PRAGMA user_version")
+            version = (await cursor.fetchone())[0]
             
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS user_sponsors (
-                    user_id INTEGER,
-                    sponsor_id INTEGER,
-                    is_subscribed BOOLEAN DEFAULT 0,
-                    PRIMARY KEY (user_id, sponsor_id)
-                )
-            ''')
+            # Схема актуальна: без DDL и записи на каждом старте
+            if version == SCHEMA_VERSION:
+                return
             
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS withdrawals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    amount REAL,
-                    status TEXT DEFAULT 'pending',
-                    created_at INTEGER DEFAULT (strftime('%s', 'now'))
-                )
-            ''')
+            if version < 1:
+                await self._migrate_to_milli(db)
+            if version < SCHEMA_VERSION:
+                await self._add_missing_columns(db, version)
             
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    amount REAL,
-                    type TEXT,
-                    description TEXT,
-                    created_at INTEGER DEFAULT (strftime('%s', 'now'))
-                )
-            ''')
+            for statement in SCHEMA:
+                await db.execute(statement)
+            if version < 5:
+                # Уже зарегистрированные пользователи не получают бонус повторно
+                await db.execute("UPDATE users SET referral_paid = 1")
             
+            await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             await db.commit()
     
+    async def _migrate_to_milli(self, db):
+        """Перевод денежных колонок REAL (STAR) в INTEGER (милли-STAR)"""
+        cursor = await db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (?, ?, ?)",
+            ('users', 'withdrawals', 'transactions')
+        )
+        existing = {row[0] for row in await cursor.fetchall()}
+        if not existing:
+            return
+        
+        await db.execute("BEGIN")
+        for table, columns, money_column in MONEY_TABLES:
+            if table not in existing:
+                continue
+            
+            await db.execute(f"ALTER TABLE {table} RENAME TO {table}_real")
+            await db.execute(SCHEMA_BY_TABLE[table])
+            
+            select = ", ".join(
+                f"CAST(ROUND({c} * {MILLI_PER_STAR}) AS INTEGER)" if c == money_column else c
+                for c in columns
+            )
+            await db.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) "
+                f"SELECT {select} FROM {table}_real"
+            )
+            await db.execute(f"DROP TABLE {table}_real")
+    
+    async def _add_missing_columns(self, db, version: int):
+        """ALTER TABLE для колонок из ADDED_COLUMNS, которых еще нет"""
+        for added_in, table, column, definition in ADDED_COLUMNS:
+            if added_in <= version:
+                continue
+            cursor = await db.execute(f"PRAGMA table_info({table})")
+            columns = {row[1] for row in await cursor.fetchall()}
+            if columns and column not in columns:
+                await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
     # Методы для работы с пользователями
     async def get_user(self, user_id: int):
         async with aiosqlite.connect(self.db_path) as db:
@@ -70,24 +191,48 @@ class Database:
             )
             return await cursor.fetchone()
     
-    async def create_user(self, user_id: int, username: str, referrer_id: int = None):
+    async def create_user(self, user_id: int, username: str, referrer_id: int = None) -> bool:
         async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
+            cursor = await db.execute(
                 '''INSERT OR IGNORE INTO users (user_id, username, referrer_id) 
                    VALUES (?, ?, ?)''',
                 (user_id, username, referrer_id)
             )
             await db.commit()
+            return cursor.rowcount > 0
     
-    async def update_balance(self, user_id: int, amount: float):
+    async def claim_click(self, user_id: int, now: int, cooldown: int) -> bool:
         async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+            cursor = await db.execute(
+                '''UPDATE users SET last_click = ? 
+                   WHERE user_id = ? AND (last_click IS NULL OR last_click <= ?)''',
+                (now, user_id, now - cooldown)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def update_balance(self, user_id: int, amount: Money):
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance",
                 (amount, user_id)
             )
+            row = await cursor.fetchone()
             await db.commit()
+        
+        self._publish(LedgerEvent(user_id, amount, "balance_update", None, int(time.time()),
+                                  row[0] if row else None))
     
-    async def add_transaction(self, user_id: int, amount: float, type: str, description: str = ""):
+    async def get_balances(self, user_ids):
+        async with aiosqlite.connect(self.db_path) as db:
+            placeholders = ", ".join("?" * len(user_ids))
+            cursor = await db.execute(
+                f"SELECT user_id, balance FROM users WHERE user_id IN ({placeholders})",
+                tuple(user_ids)
+            )
+            return dict(await cursor.fetchall())
+    
+    async def add_transaction(self, user_id: int, amount: Money, type: str, description: str = ""):
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute(
                 '''INSERT INTO transactions (user_id, amount, type, description) 
@@ -96,6 +241,99 @@ class Database:
             )
             await db.commit()
     
+    async def add_transactions(self, rows):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.executemany(
+                '''INSERT INTO transactions (user_id, amount, type, description) 
+                   VALUES (?, ?, ?, ?)''',
+                rows
+            )
+            await db.commit()
+    
+    async def credit(self, user_id: int, amount: Money, type: str, description: str = "",
+                     source_id: int = None):
+        """Изменение баланса и запись в журнал транзакций одним коммитом"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance",
+                (amount, user_id)
+            )
+            row = await cursor.fetchone()
+            await db.execute(
+                '''INSERT INTO transactions (user_id, amount, type, description) 
+                   VALUES (?, ?, ?, ?)''',
+                (user_id, amount, type, description)
+            )
+            await db.commit()
+        
+        self._publish(LedgerEvent(user_id, amount, type, source_id, int(time.time()),
+                                  row[0] if row else None))
+    
+    async def settle_bets(self, user_id: int, rows, required: Money):
+        net = sum(row[0] for row in rows)
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ? AND balance >= ? RETURNING balance",
+                (net, user_id, required)
+            )
+            settled = await cursor.fetchone()
+            if settled is None:
+                await db.rollback()
+                return None
+            
+            await db.executemany(
+                '''INSERT INTO transactions (user_id, amount, type, description) 
+                   VALUES (?, ?, ?, ?)''',
+                ((user_id, amount, type, description) for amount, type, description, _ in rows)
+            )
+            await db.commit()
+        
+        now = int(time.time())
+        for amount, type, _, count in rows:
+            self._publish(LedgerEvent(user_id, amount, type, None, now, settled[0], count))
+        return settled[0]
+    
+    async def pay_referral_bonus(self, user_id: int, referrer_amount: Money, referee_amount: Money,
+                                 referrer_description: str, referee_description: str):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute(
+                '''UPDATE users SET referral_paid = 1 
+                   WHERE user_id = ? AND referral_paid = 0 AND referrer_id IS NOT NULL 
+                   RETURNING referrer_id''',
+                (user_id,)
+            )
+            row = await cursor.fetchone()
+            if row is None:
+                await db.rollback()
+                return None
+            referrer_id = row[0]
+            
+            balances = {}
+            for target, amount, description in (
+                (referrer_id, referrer_amount, referrer_description),
+                (user_id, referee_amount, referee_description),
+            ):
+                cursor = await db.execute(
+                    "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance",
+                    (amount, target)
+                )
+                balance = await cursor.fetchone()
+                balances[target] = balance[0] if balance else None
+                await db.execute(
+                    '''INSERT INTO transactions (user_id, amount, type, description) 
+                       VALUES (?, ?, ?, ?)''',
+                    (target, amount, "referral_bonus", description)
+                )
+            await db.commit()
+        
+        now = int(time.time())
+        self._publish(LedgerEvent(referrer_id, referrer_amount, "referral_bonus", user_id, now,
+                                  balances[referrer_id]))
+        self._publish(LedgerEvent(user_id, referee_amount, "referral_bonus", None, now, balances[user_id]))
+        return referrer_id
+    
     # Методы для спонсоров
     async def get_sponsors(self):
         async with aiosqlite.connect(self.db_path) as db:
@@ -156,18 +394,82 @@ class Database:
             return total, active
     
     # Методы для выводов
-    async def create_withdrawal(self, user_id: int, amount: float):
+    async def create_withdrawal(self, user_id: int, amount: Money, status: str = 'pending'):
         async with aiosqlite.connect(self.db_path) as db:
             cursor = await db.execute(
-                '''INSERT INTO withdrawals (user_id, amount) 
-                   VALUES (?, ?) RETURNING id''',
-                (user_id, amount)
+                '''INSERT INTO withdrawals (user_id, amount, status) 
+                   VALUES (?, ?, ?) RETURNING id''',
+                (user_id, amount, status)
             )
             withdrawal_id = (await cursor.fetchone())[0]
             await db.commit()
             return withdrawal_id
     
-    async def get_withdrawals(self, status: str = None):
+    async def request_withdrawal(self, user_id: int, amount: Money, status: str = 'pending',
+                                 request_key: str = None, priority: int = 0):
+        """Создание заявки и списание баланса одной транзакцией.
+        
+        Повтор с тем же request_key возвращает уже созданную заявку.
+        Возвращает (id заявки, создана ли она сейчас) или None,
+        если на балансе недостаточно средств.
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            if request_key is not None:
+                cursor = await db.execute(
+                    "SELECT id FROM withdrawals WHERE request_key = ?",
+                    (request_key,)
+                )
+                row = await cursor.fetchone()
+                if row:
+                    await db.rollback()
+                    return row[0], False
+            
+            cursor = await db.execute(
+                "UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance >= ? RETURNING balance",
+                (amount, user_id, amount)
+            )
+            debited = await cursor.fetchone()
+            if debited is None:
+                await db.rollback()
+                return None
+            
+            cursor = await db.execute(
+                '''INSERT INTO withdrawals (user_id, amount, status, request_key, priority, updated_at) 
+                   VALUES (?, ?, ?, ?, ?, strftime('%s', 'now')) RETURNING id''',
+                (user_id, amount, status, request_key, priority)
+            )
+            withdrawal_id = (await cursor.fetchone())[0]
+            await db.execute(
+                '''INSERT INTO transactions (user_id, amount, type, description) 
+                   VALUES (?, ?, ?, ?)''',
+                (user_id, -amount, "withdrawal", f"Вывод средств #{withdrawal_id}")
+            )
+            await db.commit()
+        
+        self._publish(LedgerEvent(user_id, -amount, "withdrawal", None, int(time.time()), debited[0]))
+        return withdrawal_id, True
+    
+    async def get_withdrawal_queue(self, statuses=OPEN_WITHDRAWAL_STATUSES, limit: int = 100):
+        """Очередь заявок для админа: сначала приоритетные, затем старые"""
+        if tuple(statuses) == OPEN_WITHDRAWAL_STATUSES:
+            # Литералы, а не параметры: иначе SQLite не применит частичный индекс
+            where, params = f"w.{OPEN_WITHDRAWALS_WHERE}", ()
+        else:
+            where, params = f"w.status IN ({', '.join('?' * len(statuses))})", tuple(statuses)
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                f'''SELECT w.*, u.username 
+                   FROM withdrawals w 
+                   JOIN users u ON w.user_id = u.user_id 
+                   WHERE {where} 
+                   ORDER BY w.priority DESC, w.id 
+                   LIMIT ?''',
+                (*params, limit)
+            )
+            return await cursor.fetchall()
+    
+    async def get_withdrawals(self, status: str = None, limit: int = 50, offset: int = 0):
         async with aiosqlite.connect(self.db_path) as db:
             if status:
                 cursor = await db.execute(
@@ -175,23 +477,140 @@ class Database:
                        FROM withdrawals w 
                        JOIN users u ON w.user_id = u.user_id 
                        WHERE w.status = ? 
-                       ORDER BY w.created_at DESC''',
-                    (status,)
+                       ORDER BY w.id DESC 
+                       LIMIT ? OFFSET ?''',
+                    (status, limit, offset)
                 )
             else:
                 cursor = await db.execute(
                     '''SELECT w.*, u.username 
                        FROM withdrawals w 
                        JOIN users u ON w.user_id = u.user_id 
-                       ORDER BY w.created_at DESC'''
+                       ORDER BY w.id DESC 
+                       LIMIT ? OFFSET ?''',
+                    (limit, offset)
                 )
             return await cursor.fetchall()
     
-    async def update_withdrawal_status(self, withdrawal_id: int, status: str):
+    async def set_withdrawals_status(self, withdrawal_ids, status: str):
+        """Массовый перевод заявок в статус одной транзакцией.
+        
+        Заявки, для которых переход не разрешен WITHDRAWAL_TRANSITIONS,
+        пропускаются. При отклонении сумма возвращается на баланс.
+        Возвращает список id измененных заявок.
+        """
+        sources = withdrawal_sources(status)
+        
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("CREATE TEMP TABLE IF NOT EXISTS batch_ids (id INTEGER PRIMARY KEY)")
+            await db.execute("BEGIN IMMEDIATE")
+            await db.executemany(
+                "INSERT OR IGNORE INTO batch_ids (id) VALUES (?)",
+                ((int(i),) for i in withdrawal_ids)
+            )
+            placeholders = ", ".join("?" * len(sources))
+            cursor = await db.execute(
+                f'''UPDATE withdrawals SET status = ?, updated_at = strftime('%s', 'now') 
+                    WHERE id IN (SELECT id FROM batch_ids) AND status IN ({placeholders}) 
+                    RETURNING id, user_id, amount''',
+                (status, *sources)
+            )
+            changed = await cursor.fetchall()
+            
+            if status == 'rejected' and changed:
+                await db.executemany(
+                    "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+                    ((amount, user_id) for _, user_id, amount in changed)
+                )
+                await db.executemany(
+                    '''INSERT INTO transactions (user_id, amount, type, description) 
+                       VALUES (?, ?, ?, ?)''',
+                    ((user_id, amount, "withdrawal_refund", f"Возврат по заявке #{withdrawal_id}")
+                     for withdrawal_id, user_id, amount in changed)
+                )
+            
+            await db.execute("DELETE FROM batch_ids")
+            await db.commit()
+        
+        if status == 'rejected':
+            now = int(time.time())
+            for _, user_id, amount in changed:
+                self._publish(LedgerEvent(user_id, amount, "withdrawal_refund", None, now))
+        return [row[0] for row in changed]
+    
+    # Методы для антифрода
+    async def flag_user(self, user_id: int, reason: str):
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute(
-                "UPDATE withdrawals SET status = ? WHERE id = ?",
-                (status, withdrawal_id)
+                "INSERT OR IGNORE INTO user_flags (user_id, reason) VALUES (?, ?)",
+                (user_id, reason)
+            )
+            await db.commit()
+    
+    async def get_user_flag(self, user_id: int):
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "SELECT reason FROM user_flags WHERE user_id = ?",
+                (user_id,)
+            )
+            row = await cursor.fetchone()
+            return row[0] if row else None
+    
+    async def unflag_user(self, user_id: int) -> bool:
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "DELETE FROM user_flags WHERE user_id = ?",
+                (user_id,)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def get_flagged_users(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "SELECT user_id, reason, created_at FROM user_flags ORDER BY created_at DESC"
+            )
+            return await cursor.fetchall()
+    
+    # Методы для сидов ГСЧ
+    async def get_rng_seed(self, user_id: int):
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "SELECT * FROM rng_seeds WHERE user_id = ? AND active",
+                (user_id,)
+            )
+            return await cursor.fetchone()
+    
+    async def create_rng_seed(self, user_id: int, server_seed: str, server_seed_hash: str,
+                              client_seed: str):
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                '''INSERT OR IGNORE INTO rng_seeds (user_id, server_seed, server_seed_hash, client_seed) 
+                   VALUES (?, ?, ?, ?)''',
+                (user_id, server_seed, server_seed_hash, client_seed)
+            )
+            await db.commit()
+            return cursor.lastrowid
+    
+    async def reserve_rng_nonces(self, seed_id: int, nonce_reserved: int):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE rng_seeds SET nonce_reserved = MAX(nonce_reserved, ?) WHERE id = ?",
+                (nonce_reserved, seed_id)
+            )
+            await db.commit()
+    
+    async def rotate_rng_seed(self, seed_id: int, user_id: int, server_seed: str,
+                              server_seed_hash: str, client_seed: str):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE rng_seeds SET active = 0, revealed_at = strftime('%s', 'now') WHERE id = ?",
+                (seed_id,)
+            )
+            await db.execute(
+                '''INSERT INTO rng_seeds (user_id, server_seed, server_seed_hash, client_seed) 
+                   VALUES (?, ?, ?, ?)''',
+                (user_id, server_seed, server_seed_hash, client_seed)
             )
             await db.commit()
     
@@ -221,3 +640,15 @@ class Database:
                 'total_balance': total_balance,
                 'total_income': total_income
             }
+    
+    async def get_ledger_mismatches(self):
+        """Пользователи, чей баланс не совпадает с суммой транзакций"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                SELECT u.user_id, u.balance, COALESCE(SUM(t.amount), 0) AS ledger
+                FROM users u
+                LEFT JOIN transactions t ON t.user_id = u.user_id
+                GROUP BY u.user_id
+                HAVING u.balance != ledger
+            ''')
+            return await cursor.fetchall()
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import logging
+from contextlib import contextmanager
+from config import Config
+from money import format_stars
+
+logger = logging.getLogger(__name__)
+
+
+class EventHub:
+    """Внутрипроцессный pub/sub: события баланса для открытых веб-сессий.
+
+    Каждый подписчик получает свою ограниченную очередь; при переполнении
+    самое старое событие отбрасывается, публикация никогда не ждет клиента.
+    """
+
+    def __init__(self, queue_size: int = Config.EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.balances = {}
+
+    @contextmanager
+    def subscribe(self, user_id: int):
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self.subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self.subscribers[user_id]
+                    self.balances.pop(user_id, None)
+
+    def publish(self, user_id: int, payload: dict):
+        queues = self.subscribers.get(user_id)
+        if not queues:
+            return
+        message = json.dumps(payload, ensure_ascii=False)
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def on_ledger(self, event):
+        """Подписчик Database: изменение баланса в этом процессе"""
+        if event.user_id not in self.subscribers:
+            return
+        payload = {'type': event.type, 'delta': format_stars(event.amount)}
+        if event.balance is not None:
+            self.balances[event.user_id] = event.balance
+            payload['balance'] = format_stars(event.balance)
+        else:
+            self.balances.pop(event.user_id, None)
+        self.publish(event.user_id, payload)
+
+    async def sync_balances(self, db):
+        """Подтягивает изменения из других процессов (клики в боте)
+        одним запросом на всех подписанных пользователей"""
+        if not self.subscribers:
+            return
+        balances = await db.get_balances(list(self.subscribers))
+        for user_id, balance in balances.items():
+            previous = self.balances.get(user_id)
+            if previous == balance:
+                continue
+            self.balances[user_id] = balance
+            payload = {'type': 'balance', 'balance': format_stars(balance)}
+            if previous is not None:
+                payload['delta'] = format_stars(balance - previous)
+            self.publish(user_id, payload)
+
+    async def run(self, db, interval: float = Config.EVENTS_SYNC_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sync_balances(db)
+            except Exception:
+                logger.exception("Balance sync failed")
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import math
+import time
+from array import array
+from collections import deque
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_MASK64 = (1 << 64) - 1
+
+
+def mix64(value: int) -> int:
+    """splitmix64: перемешивание целого ключа в 64-битный хеш"""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+def _key(key) -> int:
+    return key if isinstance(key, int) else hash(key)
+
+
+class CountMinSketch:
+    """Приближенные счетчики фиксированного размера (оценка сверху)"""
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = array('I', bytes(4 * width * depth))
+
+    def _cells(self, key):
+        h = mix64(_key(key))
+        h1, h2 = h & 0xFFFFFFFF, h >> 32
+        for row in range(self.depth):
+            yield row * self.width + (h1 + row * h2) % self.width
+
+    def add(self, key, count: int = 1):
+        for cell in self._cells(key):
+            self.table[cell] += count
+
+    def estimate(self, key) -> int:
+        return min(self.table[cell] for cell in self._cells(key))
+
+    def clear(self):
+        for i in range(len(self.table)):
+            self.table[i] = 0
+
+
+class HyperLogLog:
+    """Оценка числа различных ключей в 2^p байтах"""
+
+    def __init__(self, p: int = 6):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, key):
+        h = mix64(_key(key))
+        index = h >> (64 - self.p)
+        rest = (h << self.p) & _MASK64
+        rank = 64 - self.p + 1 if rest == 0 else 65 - rest.bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other: "HyperLogLog"):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+
+class _RotatingWindow:
+    """Скользящее окно из корзин, сменяемых по кругу; старая корзина очищается"""
+
+    def __init__(self, window: int, buckets: int, factory):
+        self.span = max(window // buckets, 1)
+        self.buckets = deque(factory() for _ in range(buckets))
+        self.started = 0
+
+    def _rotate(self, now: int):
+        slot = now // self.span
+        if not self.started:
+            self.started = slot
+            return
+        steps = min(slot - self.started, len(self.buckets))
+        for _ in range(steps):
+            bucket = self.buckets.popleft()
+            bucket.clear()
+            self.buckets.append(bucket)
+        if steps:
+            self.started = slot
+
+
+class WindowedSketch(_RotatingWindow):
+    """Скользящее окно из нескольких CountMinSketch"""
+
+    def __init__(self, window: int, buckets: int = 6, width: int = 4096, depth: int = 4):
+        super().__init__(window, buckets, lambda: CountMinSketch(width, depth))
+
+    def add(self, key, now: int, count: int = 1):
+        self._rotate(now)
+        self.buckets[-1].add(key, count)
+
+    def estimate(self, key, now: int) -> int:
+        self._rotate(now)
+        return sum(bucket.estimate(key) for bucket in self.buckets)
+
+
+class WindowedDistinct(_RotatingWindow):
+    """Число различных значений по ключу за окно.
+
+    В каждой корзине словарь ключ -> HyperLogLog; ключи без событий
+    за окно уходят вместе со своей корзиной, так что память ограничена
+    активностью за окно.
+    """
+
+    def __init__(self, window: int, buckets: int = 6, p: int = 6):
+        super().__init__(window, buckets, dict)
+        self.p = p
+
+    def add(self, key, value, now: int):
+        self._rotate(now)
+        bucket = self.buckets[-1]
+        hll = bucket.get(key)
+        if hll is None:
+            hll = bucket[key] = HyperLogLog(self.p)
+        hll.add(value)
+
+    def count(self, key, now: int) -> int:
+        self._rotate(now)
+        merged = HyperLogLog(self.p)
+        for bucket in self.buckets:
+            hll = bucket.get(key)
+            if hll is not None:
+                merged.merge(hll)
+        return merged.count()
+
+
+class FraudMonitor:
+    """Потоковый антифрод по событиям журнала и запросам к играм.
+
+    Все агрегаты хранятся в памяти процесса, на горячем пути нет запросов
+    к БД; в базу пишется только сам флаг пользователя.
+    """
+
+    def __init__(self, db=None, settings: dict = None):
+        self.db = db
+        self.settings = settings or Config.FRAUD
+        s = self.settings
+        self.requests = WindowedSketch(60)
+        self.games = WindowedSketch(s['window'])
+        self.wins = WindowedSketch(s['window'])
+        self.signups = WindowedSketch(s['referral_window'])
+        self.active_referees = WindowedDistinct(s['referral_window'])
+        self.ip_users = WindowedDistinct(s['ip_window'])
+        self.flagged = {}
+        self._tasks = set()
+
+    def is_flagged(self, user_id: int) -> bool:
+        return user_id in self.flagged
+
+    def flag(self, user_id: int, reason: str):
+        if user_id in self.flagged:
+            return
+        self.flagged[user_id] = reason
+        logger.warning("User %s flagged: %s", user_id, reason)
+        if self.db is not None:
+            task = asyncio.get_running_loop().create_task(self.db.flag_user(user_id, reason))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def unflag(self, user_id: int):
+        """Снятие флага администратором (в памяти процесса и в БД)"""
+        self.flagged.pop(user_id, None)
+        if self.db is not None:
+            await self.db.unflag_user(user_id)
+
+    def observe(self, event):
+        """Подписчик Database: событие журнала после коммита"""
+        now = event.created_at
+        if event.type in ('game_win', 'game_lose'):
+            self.games.add(event.user_id, now, event.count)
+            if event.type == 'game_win':
+                self.wins.add(event.user_id, now, event.count)
+            self._check_win_rate(event.user_id, now)
+        elif event.type == 'referral_bonus' and event.source_id is not None:
+            self.signups.add(event.user_id, now)
+            self._check_referrals(event.user_id, now)
+        elif event.type == 'referral_income' and event.source_id is not None:
+            self.active_referees.add(event.user_id, event.source_id, now)
+
+    def observe_request(self, user_id: int, ip: str = None, now: int = None):
+        """Запрос к игровому API: частота по пользователю и пользователи по IP"""
+        now = now or int(time.time())
+        s = self.settings
+        self.requests.add(user_id, now)
+        if self.requests.estimate(user_id, now) > s['max_requests_per_minute']:
+            self.flag(user_id, "request burst")
+
+        if ip:
+            self.ip_users.add(ip, user_id, now)
+            if self.ip_users.count(ip, now) > s['max_users_per_ip']:
+                self.flag(user_id, f"shared ip {ip}")
+
+    def _check_win_rate(self, user_id: int, now: int):
+        s = self.settings
+        games = self.games.estimate(user_id, now)
+        if games < s['min_games']:
+            return
+        wins = self.wins.estimate(user_id, now)
+        p = s['win_rate']
+        limit = games * p + s['win_rate_z'] * math.sqrt(games * p * (1 - p))
+        if wins > limit:
+            self.flag(user_id, f"win rate {wins}/{games}")
+
+    def _check_referrals(self, referrer_id: int, now: int):
+        s = self.settings
+        signups = self.signups.estimate(referrer_id, now)
+        if signups < s['min_referrals']:
+            return
+        active = self.active_referees.count(referrer_id, now)
+        if active < signups * s['min_active_referral_ratio']:
+            self.flag(referrer_id, f"inactive referrals {active}/{signups}")
@@ -0,0 +1,98 @@
+import itertools
+import random
+from config import Config
+from money import multiply
+
+# Игры, доступные для пакетных ставок и авто-игры
+BATCH_GAMES = ('flip', 'slot')
+
+
+def play_round(game_type: str, bet: int, rng=random):
+    """Исход одной ставки: {'win', 'multiplier', 'amount'} (amount - выплата)"""
+    if game_type == 'flip':
+        # Monkey Flip
+        # Специальное событие (1.5% шанс проигрыша)
+        if rng.random() < Config.GAMES['flip']['special_event_chance']:
+            win = False
+            multiplier = 0
+        else:
+            win_chance = Config.GAMES['flip']['win_chance']
+            win = rng.random() < win_chance
+            multiplier = Config.GAMES['flip']['multiplier'] if win else 0
+
+    elif game_type == 'crash':
+        # Banana Crash
+        instant_crash = rng.random() < Config.GAMES['crash']['instant_crash_chance']
+
+        if instant_crash:
+            multiplier = 1.0
+            win = False
+        else:
+            # 2% шанс на высокий множитель
+            if rng.random() < 0.02:
+                multiplier = rng.uniform(1.5, 5.0)
+            else:
+                multiplier = rng.uniform(*Config.GAMES['crash']['low_multiplier_range'])
+
+            # Игрок должен успеть забрать (имитация)
+            player_cashout = rng.uniform(1.0, multiplier * 0.8)
+            win = player_cashout > 1.0
+
+        return {
+            'win': win,
+            'multiplier': multiplier if win else 1.0,
+            'amount': multiply(bet, multiplier) if win else 0
+        }
+
+    elif game_type == 'slot':
+        # Слот
+        combinations = Config.GAMES['slot']['total_combinations']
+        winning_combos = Config.GAMES['slot']['winning_combinations']
+
+        win = rng.randint(1, combinations) <= winning_combos
+        multiplier = Config.GAMES['slot']['win_multiplier'] if win else 0
+
+    else:
+        raise ValueError(f"Unknown game: {game_type}")
+
+    return {
+        'win': win,
+        'multiplier': multiplier,
+        'amount': multiply(bet, multiplier) if win else 0
+    }
+
+
+def play_batch(game_type: str, bets, balance: int, rngs=None,
+               stop_loss: int = None, take_profit: int = None):
+    """Серия ставок за один проход без обращений к БД.
+
+    rngs - источники случайности по одному на ставку (по умолчанию random).
+
+    Серия прерывается, когда очередная ставка больше текущего баланса
+    или когда итог достиг stop_loss / take_profit.
+    Возвращает (результаты, итог серии, минимальный стартовый баланс,
+    при котором каждая ставка серии была покрыта).
+    """
+    if game_type not in BATCH_GAMES:
+        raise ValueError(f"Game {game_type} does not support batch play")
+
+    results = []
+    net = 0
+    required = 0
+    for bet, rng in zip(bets, rngs or itertools.repeat(random)):
+        if bet > balance + net:
+            break
+        required = max(required, bet - net)
+
+        result = play_round(game_type, bet, rng)
+        result['bet'] = bet
+        result['nonce'] = getattr(rng, 'nonce', None)
+        results.append(result)
+        net += result['amount'] - bet
+
+        if stop_loss is not None and -net >= stop_loss:
+            break
+        if take_profit is not None and net >= take_profit:
+            break
+
+    return results, net, required
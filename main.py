@@ -1,7 +1,8 @@
 import asyncio
 import logging
+import os
 from datetime import datetime
-from aiogram import Bot, Dispatcher, F
+from aiogram import Bot, Dispatcher, F, Router
 from aiogram.filters import Command
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup,
@@ -10,30 +11,31 @@ from aiogram.types import (
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from config import Config
-from database import Database
+from storage import create_database
+from fraud import FraudMonitor
+from outbox import Outbox
+from user_state import HotState
+from money import from_stars, format_stars, percent
 
 logging.basicConfig(level=logging.INFO)
 
-bot = Bot(token=Config.BOT_TOKEN)
-dp = Dispatcher()
-db = Database()
+router = Router()
+db = create_database()
+fraud = FraudMonitor(db)
+db.subscribe(fraud.observe)
+hot = HotState(db)
+db.subscribe(hot.on_ledger)
+outbox = Outbox()
 
 class WithdrawState(StatesGroup):
     choosing_amount = State()
 
 # Проверка подписки на спонсоров
 async def check_subscriptions(user_id: int) -> bool:
-    sponsors = await db.get_user_sponsors_status(user_id)
-    if not sponsors:
-        return True
-    
-    for sponsor in sponsors:
-        if not sponsor[4]:  # is_subscribed
-            return False
-    return True
+    return await hot.is_subscribed(user_id)
 
 # Команда /start
-@dp.message(Command("start"))
+@router.message(Command("start"))
 async def cmd_start(message: Message):
     user_id = message.from_user.id
     username = message.from_user.username or f"user_{user_id}"
@@ -45,6 +47,8 @@ async def cmd_start(message: Message):
             referrer_id = int(message.text.split()[1])
         except:
             pass
+    if referrer_id == user_id or (referrer_id and not await db.get_user(referrer_id)):
+        referrer_id = None
     
     await db.create_user(user_id, username, referrer_id)
     
@@ -53,32 +57,22 @@ async def cmd_start(message: Message):
         await show_sponsors(message, user_id)
         return
     
-    # Начисление реферальных бонусов
-    if referrer_id:
-        user = await db.get_user(user_id)
-        if user and not user[3]:  # Если у пользователя еще нет referrer_id
-            # Обновляем referrer_id
-            await db.update_user_referrer(user_id, referrer_id)
-            
-            # Начисляем бонусы
-            await db.update_balance(referrer_id, Config.REFERRAL_REWARD_REFERRER)
-            await db.add_transaction(
-                referrer_id, 
-                Config.REFERRAL_REWARD_REFERRER, 
-                "referral_bonus",
-                f"За приглашение пользователя {username}"
-            )
-            
-            await db.update_balance(user_id, Config.REFERRAL_REWARD_REFEREE)
-            await db.add_transaction(
-                user_id,
-                Config.REFERRAL_REWARD_REFEREE,
-                "referral_bonus",
-                "За регистрацию по реферальной ссылке"
-            )
-    
+    await pay_referral_bonus(user_id, username)
     await show_main_menu(message)
 
+async def pay_referral_bonus(user_id: int, username: str):
+    """Бонусы по реферальной ссылке после первой успешной проверки подписки.
+
+    Выплата однократная; событие referral_bonus с source_id видит антифрод.
+    """
+    await db.pay_referral_bonus(
+        user_id,
+        Config.REFERRAL_REWARD_REFERRER,
+        Config.REFERRAL_REWARD_REFEREE,
+        f"За приглашение пользователя {username}",
+        "За регистрацию по реферальной ссылке"
+    )
+
 async def show_sponsors(message: Message, user_id: int):
     sponsors = await db.get_sponsors()
     if not sponsors:
@@ -101,12 +95,13 @@ async def show_sponsors(message: Message, user_id: int):
         )
     ])
     
-    await message.answer(
+    outbox.send(
+        message.chat.id,
         "📢 Чтобы начать, подпишитесь на наших спонсоров!",
         reply_markup=keyboard
     )
 
-async def show_main_menu(message: Message):
+async def show_main_menu(message: Message, edit: bool = False):
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="🐵 Заработать звезды", callback_data="earn")],
@@ -116,17 +111,20 @@ async def show_main_menu(message: Message):
         ]
     )
     
-    await message.answer(
+    user = await hot.user(message.chat.id)
+    text = (
         "🐵 *Monkey Stars* - Зарабатывай и играй!\n\n"
-        "Баланс: *{:.2f} STAR*\n"
-        "Выберите действие:".format(
-            (await db.get_user(message.from_user.id))[2] if await db.get_user(message.from_user.id) else 0
-        ),
-        reply_markup=keyboard,
-        parse_mode="Markdown"
+        "Баланс: *{} STAR*\n"
+        "Выберите действие:".format(format_stars(user.balance if user else 0))
     )
+    
+    # Из inline-меню правим текущее сообщение вместо отправки нового
+    if edit:
+        outbox.edit(message, text, reply_markup=keyboard, parse_mode="Markdown")
+    else:
+        outbox.send(message.chat.id, text, reply_markup=keyboard, parse_mode="Markdown")
 
-@dp.callback_query(F.data == "check_subscriptions")
+@router.callback_query(F.data == "check_subscriptions")
 async def check_subscriptions_callback(callback: CallbackQuery):
     user_id = callback.from_user.id
     
@@ -135,11 +133,13 @@ async def check_subscriptions_callback(callback: CallbackQuery):
     sponsors = await db.get_sponsors()
     for sponsor in sponsors:
         await db.update_user_sponsor(user_id, sponsor[0], True)
+    hot.table.set_subscribed(user_id, True)
+    await pay_referral_bonus(user_id, callback.from_user.username or f"user_{user_id}")
     
     await callback.message.delete()
     await show_main_menu(callback.message)
 
-@dp.callback_query(F.data == "earn")
+@router.callback_query(F.data == "earn")
 async def earn_menu(callback: CallbackQuery):
     if not await check_subscriptions(callback.from_user.id):
         await callback.answer("❌ Сначала подпишитесь на спонсоров!")
@@ -153,14 +153,15 @@ async def earn_menu(callback: CallbackQuery):
         ]
     )
     
-    await callback.message.edit_text(
+    outbox.edit(
+        callback.message,
         "🐵 *Заработать звезды*\n\n"
         "Выберите способ заработка:",
         reply_markup=keyboard,
         parse_mode="Markdown"
     )
 
-@dp.callback_query(F.data == "click")
+@router.callback_query(F.data == "click")
 async def click_handler(callback: CallbackQuery):
     user_id = callback.from_user.id
     
@@ -168,11 +169,11 @@ async def click_handler(callback: CallbackQuery):
         await callback.answer("❌ Сначала подпишитесь на спонсоров!")
         return
     
-    user = await db.get_user(user_id)
+    user = await hot.user(user_id)
     if not user:
         return
     
-    last_click = user[4]
+    last_click = user.last_click
     current_time = int(datetime.now().timestamp())
     
     if last_click and (current_time - last_click) < Config.CLICK_COOLDOWN:
@@ -182,44 +183,44 @@ async def click_handler(callback: CallbackQuery):
     
     # Начисляем клик
     reward = Config.CLICK_REWARD
-    await db.update_balance(user_id, reward)
     
-    # Обновляем время последнего клика
-    async with aiosqlite.connect(Config.DB_PATH) as conn:
-        await conn.execute(
-            "UPDATE users SET last_click = ? WHERE user_id = ?",
-            (current_time, user_id)
-        )
-        await conn.commit()
+    # Обновляем время последнего клика; кеш мог отстать от другого процесса,
+    # поэтому кулдаун окончательно проверяется в БД
+    if not await db.claim_click(user_id, current_time, Config.CLICK_COOLDOWN):
+        hot.table.invalidate(user_id)
+        await callback.answer("⏳ Кликер еще недоступен")
+        return
+    hot.table.set_last_click(user_id, current_time)
     
-    await db.add_transaction(user_id, reward, "click", "Кликер")
+    await db.credit(user_id, reward, "click", "Кликер")
     
     # Реферальный бонус (10%)
-    referrer_id = user[3]
+    referrer_id = user.referrer_id
     if referrer_id:
-        referral_bonus = reward * (Config.CLICK_REFERRAL_PERCENT / 100)
-        await db.update_balance(referrer_id, referral_bonus)
-        await db.add_transaction(
+        referral_bonus = percent(reward, Config.CLICK_REFERRAL_PERCENT)
+        await db.credit(
             referrer_id, 
             referral_bonus, 
             "referral_income",
-            f"10% от клика пользователя {callback.from_user.username or user_id}"
+            f"10% от клика пользователя {callback.from_user.username or user_id}",
+            source_id=user_id
         )
     
-    await callback.answer(f"✅ +{reward} STAR")
+    await callback.answer(f"✅ +{format_stars(reward, 1)} STAR")
     
     # Обновляем сообщение
-    user = await db.get_user(user_id)
-    await callback.message.edit_text(
+    user = await hot.user(user_id)
+    outbox.edit(
+        callback.message,
         f"🐵 *Кликер*\n\n"
-        f"✅ Вы получили *{reward} STAR*\n"
-        f"💰 Баланс: *{user[2]:.2f} STAR*\n\n"
+        f"✅ Вы получили *{format_stars(reward, 1)} STAR*\n"
+        f"💰 Баланс: *{format_stars(user.balance)} STAR*\n\n"
         f"Следующий клик через 1 час",
         parse_mode="Markdown",
         reply_markup=callback.message.reply_markup
     )
 
-@dp.callback_query(F.data == "withdraw")
+@router.callback_query(F.data == "withdraw")
 async def withdraw_menu(callback: CallbackQuery, state: FSMContext):
     if not await check_subscriptions(callback.from_user.id):
         await callback.answer("❌ Сначала подпишитесь на спонсоров!")
@@ -235,50 +236,78 @@ async def withdraw_menu(callback: CallbackQuery, state: FSMContext):
         ]
     )
     
-    await callback.message.edit_text(
+    outbox.edit(
+        callback.message,
         "💸 *Вывод средств*\n\n"
         "Выберите сумму для вывода:",
         reply_markup=keyboard,
         parse_mode="Markdown"
     )
 
-@dp.callback_query(F.data.startswith("withdraw_"))
+@router.callback_query(F.data.startswith("withdraw_"))
 async def withdraw_handler(callback: CallbackQuery):
     user_id = callback.from_user.id
-    amount = float(callback.data.split("_")[1])
+    amount = from_stars(callback.data.split("_")[1])
     
-    user = await db.get_user(user_id)
+    # Решение о деньгах: баланс и рефералы читаются из БД, а не из кеша,
+    # который может отставать от записей сайта на STATE_TTL
+    user = await hot.fresh_user(user_id)
     if not user:
         return
     
     # Проверка баланса
-    if user[2] < amount:
-        await callback.answer(f"❌ Недостаточно STAR. Ваш баланс: {user[2]:.2f}")
+    if user.balance < amount:
+        await callback.answer(f"❌ Недостаточно STAR. Ваш баланс: {format_stars(user.balance)}")
         return
     
     # Проверка активных рефералов
-    total_ref, active_ref = await db.get_user_referrals(user_id)
+    total_ref, active_ref = await hot.referrals(user_id)
     if active_ref < 3:
         await callback.answer(f"❌ Нужно 3 активных реферала. У вас: {active_ref}")
         return
     
-    # Создаем заявку на вывод
-    withdrawal_id = await db.create_withdrawal(user_id, amount)
-    
-    # Списание баланса
-    await db.update_balance(user_id, -amount)
-    await db.add_transaction(user_id, -amount, "withdrawal", f"Вывод средств #{withdrawal_id}")
+    # Заявки пользователей с антифрод-флагом удерживаются до ручной проверки
+    # Флаг читается из БД: снятие флага администратором на сайте
+    # должно действовать и в процессе бота
+    held = await db.get_user_flag(user_id) is not None
+    
+    # Создаем заявку и списываем баланс одной транзакцией;
+    # повторная доставка того же callback не создаст вторую заявку
+    created = await db.request_withdrawal(
+        user_id,
+        amount,
+        'hold' if held else 'pending',
+        request_key=f"tg:{callback.id}",
+        priority=-1 if held else 0
+    )
+    if created is None:
+        hot.table.invalidate(user_id)
+        await callback.answer("❌ Недостаточно STAR")
+        return
+    withdrawal_id, _ = created
+    
+    if held:
+        outbox.edit(
+            callback.message,
+            f"⏳ *Заявка на вывод на проверке*\n\n"
+            f"💰 Сумма: *{format_stars(amount, 0)} STAR*\n"
+            f"📝 ID заявки: *#{withdrawal_id}*\n\n"
+            f"Заявка будет рассмотрена администратором.",
+            parse_mode="Markdown"
+        )
+        return
     
-    await callback.message.edit_text(
+    outbox.edit(
+        callback.message,
         f"✅ *Заявка на вывод одобрена!*\n\n"
-        f"💰 Сумма: *{amount} STAR*\n"
+        f"💰 Сумма: *{format_stars(amount, 0)} STAR*\n"
         f"📝 ID заявки: *#{withdrawal_id}*\n\n"
         f"Для получения средств свяжитесь с поддержкой: @MonkeyStarsov\n"
-        f"Укажите ваш ID: `{user_id}` и сумму: `{amount} STAR`",
+        f"Укажите ваш ID: `{user_id}` и сумму: `{format_stars(amount, 0)} STAR`",
         parse_mode="Markdown"
     )
 
-@dp.callback_query(F.data == "profile")
+@router.callback_query(F.data == "profile")
 async def profile_handler(callback: CallbackQuery):
     user_id = callback.from_user.id
     
@@ -286,13 +315,13 @@ async def profile_handler(callback: CallbackQuery):
         await callback.answer("❌ Сначала подпишитесь на спонсоров!")
         return
     
-    user = await db.get_user(user_id)
+    user = await hot.user(user_id)
     if not user:
         return
     
-    total_ref, active_ref = await db.get_user_referrals(user_id)
+    total_ref, active_ref = await hot.referrals(user_id)
     
-    last_click = user[4]
+    last_click = user.last_click
     current_time = int(datetime.now().timestamp())
     if last_click:
         time_passed = current_time - last_click
@@ -307,7 +336,7 @@ async def profile_handler(callback: CallbackQuery):
     text = (
         f"📊 *Профиль*\n\n"
         f"👤 ID: `{user_id}`\n"
-        f"💰 Баланс: *{user[2]:.2f} STAR*\n"
+        f"💰 Баланс: *{format_stars(user.balance)} STAR*\n"
         f"👥 Рефералов: *{active_ref}* / {total_ref}\n"
         f"⏰ Кликер доступен: {next_click}"
     )
@@ -318,9 +347,9 @@ async def profile_handler(callback: CallbackQuery):
         ]
     )
     
-    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+    outbox.edit(callback.message, text, reply_markup=keyboard, parse_mode="Markdown")
 
-@dp.callback_query(F.data == "referral")
+@router.callback_query(F.data == "referral")
 async def referral_handler(callback: CallbackQuery):
     user_id = callback.from_user.id
     
@@ -328,7 +357,7 @@ async def referral_handler(callback: CallbackQuery):
         await callback.answer("❌ Сначала подпишитесь на спонсоров!")
         return
     
-    total_ref, active_ref = await db.get_user_referrals(user_id)
+    total_ref, active_ref = await hot.referrals(user_id)
     
     text = (
         f"👥 *Реферальная система*\n\n"
@@ -349,15 +378,16 @@ async def referral_handler(callback: CallbackQuery):
         ]
     )
     
-    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="Markdown")
+    outbox.edit(callback.message, text, reply_markup=keyboard, parse_mode="Markdown")
 
-@dp.callback_query(F.data == "main_menu")
+@router.callback_query(F.data == "main_menu")
 async def back_to_main(callback: CallbackQuery):
-    await show_main_menu(callback.message)
+    await callback.answer()
+    await show_main_menu(callback.message, edit=True)
 
 # Проверка подписки перед любым действием
-@dp.callback_query()
-async def check_subscription_before_action(callback: CallbackQuery):
+@router.callback_query()
+async def check_subscription_before_action(callback: CallbackQuery, dispatcher: Dispatcher):
     if callback.data not in ["check_subscriptions", "main_menu"]:
         if not await check_subscriptions(callback.from_user.id):
             await callback.answer("❌ Доступ ограничен! Подпишитесь на спонсоров!", show_alert=True)
@@ -368,14 +398,45 @@ async def check_subscription_before_action(callback: CallbackQuery):
             return
     
     # Передаем обработку дальше
-    await dp.feed_update(bot=bot, update=callback)
+    await dispatcher.feed_update(bot=callback.bot, update=callback)
+
+def create_bot() -> Bot:
+    return Bot(token=Config.BOT_TOKEN)
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
 
 async def main():
     # Инициализация БД
     await db.init_db()
     
+    # Теплый старт горячего состояния пользователей
+    state_path = os.path.join(Config.STATE_DIR, "bot.state")
+    hot.load(state_path)
+    
+    bot = create_bot()
+    dp = create_dispatcher()
+    outbox.start(bot)
+    
+    # Фоновые снимки файла SQLite (модуль нужен только процессу бота)
+    from database import Database
+    backups = None
+    if isinstance(db, Database):
+        from backup import BackupService
+        backups = BackupService(db.db_path)
+        backups.start()
+    
     # Запуск бота
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await outbox.stop()
+        if backups:
+            await backups.stop()
+        hot.save(state_path)
+        await db.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,46 @@
+from decimal import Decimal, InvalidOperation, ROUND_DOWN, ROUND_HALF_UP
+from typing import NewType
+
+# Все денежные суммы хранятся и считаются в целых милли-STAR (1 STAR = 1000).
+# Перевод в дробные STAR выполняется только при выводе пользователю.
+Money = NewType("Money", int)
+
+MILLI_PER_STAR = 1000
+
+_MILLI = Decimal(MILLI_PER_STAR)
+
+
+def from_stars(value) -> Money:
+    """Перевод суммы в STAR (число или строка) в милли-STAR с округлением.
+    
+    Нечисловые значения, NaN и бесконечность - ValueError.
+    """
+    try:
+        amount = Decimal(str(value)) * _MILLI
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {value!r}") from None
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount: {value!r}")
+    return Money(int(amount.quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+
+
+def to_stars(amount: int) -> Decimal:
+    """Перевод милли-STAR в точное десятичное значение STAR"""
+    return Decimal(int(amount)) / _MILLI
+
+
+def format_stars(amount: int, places: int = 2) -> str:
+    """Строковое представление суммы для отображения"""
+    quantum = Decimal(1).scaleb(-places)
+    return str(to_stars(amount).quantize(quantum, rounding=ROUND_DOWN))
+
+
+def percent(amount: int, pct: int) -> Money:
+    """Целая доля суммы в процентах (округление вниз)"""
+    return Money(int(amount) * pct // 100)
+
+
+def multiply(amount: int, multiplier: float) -> Money:
+    """Сумма, умноженная на дробный множитель игры (округление вниз)"""
+    product = Decimal(int(amount)) * Decimal(str(multiplier))
+    return Money(int(product.to_integral_value(rounding=ROUND_DOWN)))
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class _Op:
+    __slots__ = ('kind', 'chat_id', 'message_id', 'kwargs')
+
+    def __init__(self, kind: str, chat_id: int, message_id: int, kwargs: dict):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.kwargs = kwargs
+
+
+class RateLimiter:
+    """Token bucket: не больше rate операций в секунду"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Outbox:
+    """Очередь исходящих сообщений Telegram.
+
+    Обработчики только ставят операции в очередь и сразу возвращаются.
+    У каждого чата своя очередь (порядок сохраняется) и минимальный
+    интервал между отправками; общий поток ограничен RateLimiter.
+    Несколько ожидающих правок одного сообщения сводятся к последней.
+    На TelegramRetryAfter чат откладывается на указанное время.
+    """
+
+    def __init__(
+        self,
+        chat_interval: float = Config.OUTBOX_CHAT_INTERVAL,
+        global_rate: float = Config.OUTBOX_GLOBAL_RATE,
+        concurrency: int = Config.OUTBOX_CONCURRENCY,
+    ):
+        self.chat_interval = chat_interval
+        self.limiter = RateLimiter(global_rate)
+        self.concurrency = concurrency
+        self.chats = {}
+        self.edits = {}
+        self.next_at = {}
+        self.ready = asyncio.Queue()
+        self.bot = None
+        self._task = None
+
+    def send(self, chat_id: int, text: str, **kwargs):
+        self._push(_Op('send', chat_id, None, {'text': text, **kwargs}))
+
+    def edit(self, message, text: str, **kwargs):
+        """Правка сообщения; заменяет еще не отправленную правку того же сообщения"""
+        key = (message.chat.id, message.message_id)
+        pending = self.edits.get(key)
+        if pending is not None:
+            pending.kwargs = {'text': text, **kwargs}
+            return
+        op = _Op('edit', message.chat.id, message.message_id, {'text': text, **kwargs})
+        self.edits[key] = op
+        self._push(op)
+
+    def _push(self, op: _Op):
+        queue = self.chats.get(op.chat_id)
+        if queue is None:
+            queue = self.chats[op.chat_id] = deque()
+            self._schedule(op.chat_id)
+        queue.append(op)
+
+    def _schedule(self, chat_id: int):
+        delay = self.next_at.get(chat_id, 0) - time.monotonic()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.ready.put_nowait, chat_id)
+        else:
+            self.ready.put_nowait(chat_id)
+
+    async def _deliver(self, chat_id: int, op: _Op):
+        try:
+            if op.kind == 'edit':
+                await self.bot.edit_message_text(
+                    chat_id=chat_id, message_id=op.message_id, **op.kwargs
+                )
+            else:
+                await self.bot.send_message(chat_id, **op.kwargs)
+        except TelegramRetryAfter as e:
+            key = (chat_id, op.message_id)
+            # Если, пока запрос был в полете, в очередь встала более новая
+            # правка того же сообщения, старая не повторяется
+            if op.kind != 'edit' or key not in self.edits:
+                self.chats.setdefault(chat_id, deque()).appendleft(op)
+                if op.kind == 'edit':
+                    self.edits[key] = op
+            self.next_at[chat_id] = time.monotonic() + e.retry_after
+            logger.warning("Flood limit for chat %s, retry after %s s", chat_id, e.retry_after)
+        except TelegramBadRequest as e:
+            # Например, "message is not modified" после сведения правок
+            logger.debug("Dropped %s to chat %s: %s", op.kind, chat_id, e)
+        except Exception:
+            logger.exception("Failed to %s message in chat %s", op.kind, chat_id)
+
+    async def _run_chat(self, chat_id: int, semaphore: asyncio.Semaphore):
+        try:
+            queue = self.chats.get(chat_id)
+            if queue:
+                op = queue.popleft()
+                if op.kind == 'edit':
+                    self.edits.pop((chat_id, op.message_id), None)
+                self.next_at[chat_id] = time.monotonic() + self.chat_interval
+                await self._deliver(chat_id, op)
+        finally:
+            semaphore.release()
+
+        if self.chats.get(chat_id):
+            self._schedule(chat_id)
+        else:
+            self.chats.pop(chat_id, None)
+            delay = max(self.next_at.get(chat_id, 0) - time.monotonic(), 0)
+            asyncio.get_running_loop().call_later(delay, self._forget, chat_id)
+
+    def _forget(self, chat_id: int):
+        if chat_id not in self.chats:
+            self.next_at.pop(chat_id, None)
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        while True:
+            chat_id = await self.ready.get()
+            await semaphore.acquire()
+            await self.limiter.acquire()
+            task = asyncio.create_task(self._run_chat(chat_id, semaphore))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    def start(self, bot):
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
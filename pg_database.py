@@ -0,0 +1,554 @@
+import time
+from money import Money
+from storage import (
+    LedgerEvent, OPEN_WITHDRAWAL_STATUSES, OPEN_WITHDRAWALS_WHERE, StorageBackend, withdrawal_sources
+)
+from config import Config
+
+SCHEMA_VERSION = 4
+
+_NOW = "EXTRACT(EPOCH FROM now())::BIGINT"
+
+# Колонки и их порядок совпадают со схемой SQLite (database.py),
+# чтобы обработчики могли обращаться к строкам по индексу.
+SCHEMA = [
+    f'''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT,
+        balance BIGINT NOT NULL DEFAULT 0,
+        referrer_id BIGINT DEFAULT NULL,
+        last_click BIGINT DEFAULT NULL,
+        created_at BIGINT DEFAULT {_NOW},
+        referral_paid BOOLEAN DEFAULT FALSE
+    )
+    ''',
+    '''ALTER TABLE users ADD COLUMN IF NOT EXISTS referral_paid BOOLEAN DEFAULT FALSE''',
+    '''
+    CREATE TABLE IF NOT EXISTS sponsors (
+        id BIGSERIAL PRIMARY KEY,
+        channel_username TEXT NOT NULL,
+        channel_id TEXT NOT NULL,
+        channel_url TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_sponsors (
+        user_id BIGINT,
+        sponsor_id BIGINT,
+        is_subscribed BOOLEAN DEFAULT FALSE,
+        PRIMARY KEY (user_id, sponsor_id)
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS withdrawals (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        amount BIGINT,
+        status TEXT DEFAULT 'pending',
+        created_at BIGINT DEFAULT {_NOW},
+        request_key TEXT UNIQUE,
+        priority INTEGER DEFAULT 0,
+        updated_at BIGINT
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        amount BIGINT,
+        type TEXT,
+        description TEXT,
+        created_at BIGINT DEFAULT {_NOW}
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS user_flags (
+        user_id BIGINT PRIMARY KEY,
+        reason TEXT,
+        created_at BIGINT DEFAULT {_NOW}
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS rng_seeds (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        server_seed TEXT NOT NULL,
+        server_seed_hash TEXT NOT NULL,
+        client_seed TEXT NOT NULL,
+        nonce_reserved BIGINT DEFAULT 0,
+        active BOOLEAN DEFAULT TRUE,
+        created_at BIGINT DEFAULT {_NOW},
+        revealed_at BIGINT
+    )
+    ''',
+    '''CREATE UNIQUE INDEX IF NOT EXISTS idx_rng_seeds_active
+       ON rng_seeds (user_id) WHERE active''',
+    # Очередь открытых заявок читается по индексу без сортировки
+    '''DROP INDEX IF EXISTS idx_withdrawals_queue''',
+    f'''CREATE INDEX IF NOT EXISTS idx_withdrawals_open
+       ON withdrawals (priority DESC, id) WHERE {OPEN_WITHDRAWALS_WHERE}''',
+    '''CREATE INDEX IF NOT EXISTS idx_users_referrer ON users (referrer_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id)''',
+    '''CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)''',
+]
+
+TRANSACTION_COLUMNS = ('user_id', 'amount', 'type', 'description')
+
+
+class _DuplicateRequest(Exception):
+    """Заявка с тем же request_key создана параллельным запросом"""
+
+
+class PostgresDatabase(StorageBackend):
+    """Хранилище на PostgreSQL через пул asyncpg.
+
+    Балансы меняются одним атомарным UPDATE (без SELECT ... FOR UPDATE),
+    пакеты строк журнала пишутся через COPY. Вместо dsn можно передать
+    готовый пул с интерфейсом asyncpg (например, тестовую заглушку).
+    """
+
+    def __init__(self, dsn: str = None, pool=None):
+        super().__init__()
+        self.dsn = dsn
+        self.pool = pool
+
+    async def init_db(self):
+        if self.pool is None:
+            import asyncpg
+            self.pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=Config.PG_POOL_MIN,
+                max_size=Config.PG_POOL_MAX
+            )
+
+        async with self.pool.acquire() as conn:
+            version = await conn.fetchval(
+                "SELECT version FROM schema_version"
+                if await conn.fetchval("SELECT to_regclass('schema_version')")
+                else "SELECT 0"
+            )
+            if version == SCHEMA_VERSION:
+                return
+
+            async with conn.transaction():
+                for statement in SCHEMA:
+                    await conn.execute(statement)
+                if version and version < 3:
+                    # Уже зарегистрированные пользователи не получают бонус повторно
+                    await conn.execute("UPDATE users SET referral_paid = TRUE")
+                await conn.execute("DELETE FROM schema_version")
+                await conn.execute(
+                    "INSERT INTO schema_version (version) VALUES ($1)",
+                    SCHEMA_VERSION
+                )
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    # Методы для работы с пользователями
+    async def get_user(self, user_id: int):
+        return await self.pool.fetchrow(
+            "SELECT * FROM users WHERE user_id = $1",
+            user_id
+        )
+
+    async def create_user(self, user_id: int, username: str, referrer_id: int = None) -> bool:
+        status = await self.pool.execute(
+            '''INSERT INTO users (user_id, username, referrer_id)
+               VALUES ($1, $2, $3) ON CONFLICT (user_id) DO NOTHING''',
+            user_id, username, referrer_id
+        )
+        return status != "INSERT 0 0"
+
+    async def claim_click(self, user_id: int, now: int, cooldown: int) -> bool:
+        status = await self.pool.execute(
+            '''UPDATE users SET last_click = $1
+               WHERE user_id = $2 AND (last_click IS NULL OR last_click <= $3)''',
+            now, user_id, now - cooldown
+        )
+        return status != "UPDATE 0"
+
+    async def update_balance(self, user_id: int, amount: Money):
+        balance = await self.pool.fetchval(
+            "UPDATE users SET balance = balance + $1 WHERE user_id = $2 RETURNING balance",
+            amount, user_id
+        )
+        self._publish(LedgerEvent(user_id, amount, "balance_update", None, int(time.time()), balance))
+
+    async def get_balances(self, user_ids):
+        rows = await self.pool.fetch(
+            "SELECT user_id, balance FROM users WHERE user_id = ANY($1::bigint[])",
+            list(user_ids)
+        )
+        return {row['user_id']: row['balance'] for row in rows}
+
+    async def add_transaction(self, user_id: int, amount: Money, type: str, description: str = ""):
+        await self.pool.execute(
+            '''INSERT INTO transactions (user_id, amount, type, description)
+               VALUES ($1, $2, $3, $4)''',
+            user_id, amount, type, description
+        )
+
+    async def add_transactions(self, rows):
+        async with self.pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                'transactions',
+                records=list(rows),
+                columns=TRANSACTION_COLUMNS
+            )
+
+    async def credit(self, user_id: int, amount: Money, type: str, description: str = "",
+                     source_id: int = None):
+        """Изменение баланса и запись в журнал одним запросом"""
+        balance = await self.pool.fetchval(
+            '''WITH updated AS (
+                   UPDATE users SET balance = balance + $2 WHERE user_id = $1 RETURNING balance
+               ), logged AS (
+                   INSERT INTO transactions (user_id, amount, type, description)
+                   VALUES ($1, $2, $3, $4)
+               )
+               SELECT balance FROM updated''',
+            user_id, amount, type, description
+        )
+        self._publish(LedgerEvent(user_id, amount, type, source_id, int(time.time()), balance))
+
+    async def settle_bets(self, user_id: int, rows, required: Money):
+        net = sum(row[0] for row in rows)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                balance = await conn.fetchval(
+                    '''UPDATE users SET balance = balance + $1
+                       WHERE user_id = $2 AND balance >= $3 RETURNING balance''',
+                    net, user_id, required
+                )
+                if balance is None:
+                    return None
+                await conn.copy_records_to_table(
+                    'transactions',
+                    records=[(user_id, amount, type, description) for amount, type, description, _ in rows],
+                    columns=TRANSACTION_COLUMNS
+                )
+
+        now = int(time.time())
+        for amount, type, _, count in rows:
+            self._publish(LedgerEvent(user_id, amount, type, None, now, balance, count))
+        return balance
+
+    async def pay_referral_bonus(self, user_id: int, referrer_amount: Money, referee_amount: Money,
+                                 referrer_description: str, referee_description: str):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                referrer_id = await conn.fetchval(
+                    '''UPDATE users SET referral_paid = TRUE
+                       WHERE user_id = $1 AND NOT referral_paid AND referrer_id IS NOT NULL
+                       RETURNING referrer_id''',
+                    user_id
+                )
+                if referrer_id is None:
+                    return None
+                rows = await conn.fetch(
+                    '''UPDATE users u SET balance = u.balance + b.amount
+                       FROM unnest($1::bigint[], $2::bigint[]) AS b(user_id, amount)
+                       WHERE u.user_id = b.user_id
+                       RETURNING u.user_id, u.balance''',
+                    [referrer_id, user_id], [referrer_amount, referee_amount]
+                )
+                await conn.copy_records_to_table(
+                    'transactions',
+                    records=[
+                        (referrer_id, referrer_amount, "referral_bonus", referrer_description),
+                        (user_id, referee_amount, "referral_bonus", referee_description),
+                    ],
+                    columns=TRANSACTION_COLUMNS
+                )
+
+        balances = {row['user_id']: row['balance'] for row in rows}
+        now = int(time.time())
+        self._publish(LedgerEvent(referrer_id, referrer_amount, "referral_bonus", user_id, now,
+                                  balances.get(referrer_id)))
+        self._publish(LedgerEvent(user_id, referee_amount, "referral_bonus", None, now, balances.get(user_id)))
+        return referrer_id
+
+    # Методы для спонсоров
+    async def get_sponsors(self):
+        return await self.pool.fetch("SELECT * FROM sponsors ORDER BY id")
+
+    async def add_sponsor(self, channel_username: str, channel_id: str, channel_url: str):
+        await self.pool.execute(
+            '''INSERT INTO sponsors (channel_username, channel_id, channel_url)
+               VALUES ($1, $2, $3)''',
+            channel_username, channel_id, channel_url
+        )
+
+    async def delete_sponsor(self, sponsor_id: int):
+        await self.pool.execute("DELETE FROM sponsors WHERE id = $1", sponsor_id)
+
+    # Методы для проверки подписки
+    async def update_user_sponsor(self, user_id: int, sponsor_id: int, is_subscribed: bool):
+        await self.pool.execute(
+            '''INSERT INTO user_sponsors (user_id, sponsor_id, is_subscribed)
+               VALUES ($1, $2, $3)
+               ON CONFLICT (user_id, sponsor_id) DO UPDATE SET is_subscribed = EXCLUDED.is_subscribed''',
+            user_id, sponsor_id, is_subscribed
+        )
+
+    async def get_user_sponsors_status(self, user_id: int):
+        return await self.pool.fetch('''
+            SELECT s.*, us.is_subscribed
+            FROM sponsors s
+            LEFT JOIN user_sponsors us ON s.id = us.sponsor_id AND us.user_id = $1
+            ORDER BY s.id
+        ''', user_id)
+
+    # Методы для рефералов
+    async def get_user_referrals(self, user_id: int):
+        row = await self.pool.fetchrow('''
+            SELECT
+                (SELECT COUNT(*) FROM users WHERE referrer_id = $1),
+                (SELECT COUNT(DISTINCT u.user_id)
+                 FROM users u
+                 JOIN user_sponsors us ON u.user_id = us.user_id
+                 WHERE u.referrer_id = $1 AND us.is_subscribed)
+        ''', user_id)
+        return row[0], row[1]
+
+    # Методы для выводов
+    async def create_withdrawal(self, user_id: int, amount: Money, status: str = 'pending'):
+        return await self.pool.fetchval(
+            '''INSERT INTO withdrawals (user_id, amount, status)
+               VALUES ($1, $2, $3) RETURNING id''',
+            user_id, amount, status
+        )
+
+    async def request_withdrawal(self, user_id: int, amount: Money, status: str = 'pending',
+                                 request_key: str = None, priority: int = 0):
+        """Создание заявки и списание баланса одной транзакцией.
+
+        Повтор с тем же request_key возвращает уже созданную заявку.
+        Возвращает (id заявки, создана ли она сейчас) или None,
+        если на балансе недостаточно средств.
+        """
+        async with self.pool.acquire() as conn:
+            if request_key is not None:
+                existing = await conn.fetchval(
+                    "SELECT id FROM withdrawals WHERE request_key = $1",
+                    request_key
+                )
+                if existing is not None:
+                    return existing, False
+
+            try:
+                async with conn.transaction():
+                    debited = await conn.fetchval(
+                        '''UPDATE users SET balance = balance - $1
+                           WHERE user_id = $2 AND balance >= $1 RETURNING balance''',
+                        amount, user_id
+                    )
+                    if debited is None:
+                        return None
+
+                    withdrawal_id = await conn.fetchval(
+                        f'''INSERT INTO withdrawals (user_id, amount, status, request_key, priority, updated_at)
+                            VALUES ($1, $2, $3, $4, $5, {_NOW})
+                            ON CONFLICT (request_key) DO NOTHING RETURNING id''',
+                        user_id, amount, status, request_key, priority
+                    )
+                    if withdrawal_id is None:
+                        # Параллельный запрос с тем же ключом успел раньше:
+                        # откатываем списание и возвращаем его заявку
+                        raise _DuplicateRequest()
+
+                    await conn.execute(
+                        '''INSERT INTO transactions (user_id, amount, type, description)
+                           VALUES ($1, $2, $3, $4)''',
+                        user_id, -amount, "withdrawal", f"Вывод средств #{withdrawal_id}"
+                    )
+            except _DuplicateRequest:
+                existing = await conn.fetchval(
+                    "SELECT id FROM withdrawals WHERE request_key = $1",
+                    request_key
+                )
+                return existing, False
+        self._publish(LedgerEvent(user_id, -amount, "withdrawal", None, int(time.time()), debited))
+        return withdrawal_id, True
+
+    async def get_withdrawal_queue(self, statuses=OPEN_WITHDRAWAL_STATUSES, limit: int = 100):
+        """Очередь заявок для админа: сначала приоритетные, затем старые"""
+        if tuple(statuses) == OPEN_WITHDRAWAL_STATUSES:
+            # Литералы, а не параметр: иначе планировщик не применит частичный индекс
+            return await self.pool.fetch(
+                f'''SELECT w.*, u.username
+                    FROM withdrawals w
+                    JOIN users u ON w.user_id = u.user_id
+                    WHERE w.{OPEN_WITHDRAWALS_WHERE}
+                    ORDER BY w.priority DESC, w.id
+                    LIMIT $1''',
+                limit
+            )
+        return await self.pool.fetch(
+            '''SELECT w.*, u.username
+               FROM withdrawals w
+               JOIN users u ON w.user_id = u.user_id
+               WHERE w.status = ANY($1::text[])
+               ORDER BY w.priority DESC, w.id
+               LIMIT $2''',
+            list(statuses), limit
+        )
+
+    async def get_withdrawals(self, status: str = None, limit: int = 50, offset: int = 0):
+        if status:
+            return await self.pool.fetch(
+                '''SELECT w.*, u.username
+                   FROM withdrawals w
+                   JOIN users u ON w.user_id = u.user_id
+                   WHERE w.status = $1
+                   ORDER BY w.id DESC
+                   LIMIT $2 OFFSET $3''',
+                status, limit, offset
+            )
+        return await self.pool.fetch(
+            '''SELECT w.*, u.username
+               FROM withdrawals w
+               JOIN users u ON w.user_id = u.user_id
+               ORDER BY w.id DESC
+               LIMIT $1 OFFSET $2''',
+            limit, offset
+        )
+
+    async def set_withdrawals_status(self, withdrawal_ids, status: str):
+        """Массовый перевод заявок в статус одной транзакцией.
+
+        Заявки, для которых переход не разрешен WITHDRAWAL_TRANSITIONS,
+        пропускаются. При отклонении сумма возвращается на баланс.
+        Возвращает список id измененных заявок.
+        """
+        sources = withdrawal_sources(status)
+        ids = [int(i) for i in withdrawal_ids]
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                changed = await conn.fetch(
+                    f'''UPDATE withdrawals SET status = $1, updated_at = {_NOW}
+                        WHERE id = ANY($2::bigint[]) AND status = ANY($3::text[])
+                        RETURNING id, user_id, amount''',
+                    status, ids, sources
+                )
+                if status == 'rejected' and changed:
+                    # Один UPDATE на всех пользователей пакета
+                    await conn.execute(
+                        '''UPDATE users u SET balance = u.balance + r.amount
+                           FROM (SELECT user_id, SUM(amount) AS amount
+                                 FROM unnest($1::bigint[], $2::bigint[]) AS t(user_id, amount)
+                                 GROUP BY user_id) r
+                           WHERE u.user_id = r.user_id''',
+                        [row['user_id'] for row in changed],
+                        [row['amount'] for row in changed]
+                    )
+                    await conn.copy_records_to_table(
+                        'transactions',
+                        records=[
+                            (row['user_id'], row['amount'], "withdrawal_refund",
+                             f"Возврат по заявке #{row['id']}")
+                            for row in changed
+                        ],
+                        columns=TRANSACTION_COLUMNS
+                    )
+
+        if status == 'rejected':
+            now = int(time.time())
+            for row in changed:
+                self._publish(LedgerEvent(row['user_id'], row['amount'], "withdrawal_refund", None, now))
+        return [row['id'] for row in changed]
+
+    # Методы для антифрода
+    async def flag_user(self, user_id: int, reason: str):
+        await self.pool.execute(
+            '''INSERT INTO user_flags (user_id, reason) VALUES ($1, $2)
+               ON CONFLICT (user_id) DO NOTHING''',
+            user_id, reason
+        )
+
+    async def get_user_flag(self, user_id: int):
+        return await self.pool.fetchval(
+            "SELECT reason FROM user_flags WHERE user_id = $1",
+            user_id
+        )
+
+    async def unflag_user(self, user_id: int) -> bool:
+        status = await self.pool.execute(
+            "DELETE FROM user_flags WHERE user_id = $1",
+            user_id
+        )
+        return status != "DELETE 0"
+
+    async def get_flagged_users(self):
+        return await self.pool.fetch(
+            "SELECT user_id, reason, created_at FROM user_flags ORDER BY created_at DESC"
+        )
+
+    # Методы для сидов ГСЧ
+    async def get_rng_seed(self, user_id: int):
+        return await self.pool.fetchrow(
+            "SELECT * FROM rng_seeds WHERE user_id = $1 AND active",
+            user_id
+        )
+
+    async def create_rng_seed(self, user_id: int, server_seed: str, server_seed_hash: str,
+                              client_seed: str):
+        return await self.pool.fetchval(
+            '''INSERT INTO rng_seeds (user_id, server_seed, server_seed_hash, client_seed)
+               VALUES ($1, $2, $3, $4)
+               ON CONFLICT (user_id) WHERE active DO NOTHING RETURNING id''',
+            user_id, server_seed, server_seed_hash, client_seed
+        )
+
+    async def reserve_rng_nonces(self, seed_id: int, nonce_reserved: int):
+        await self.pool.execute(
+            "UPDATE rng_seeds SET nonce_reserved = GREATEST(nonce_reserved, $1) WHERE id = $2",
+            nonce_reserved, seed_id
+        )
+
+    async def rotate_rng_seed(self, seed_id: int, user_id: int, server_seed: str,
+                              server_seed_hash: str, client_seed: str):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    f"UPDATE rng_seeds SET active = FALSE, revealed_at = {_NOW} WHERE id = $1",
+                    seed_id
+                )
+                await conn.execute(
+                    '''INSERT INTO rng_seeds (user_id, server_seed, server_seed_hash, client_seed)
+                       VALUES ($1, $2, $3, $4)''',
+                    user_id, server_seed, server_seed_hash, client_seed
+                )
+
+    # Админ методы
+    async def get_all_users(self):
+        return await self.pool.fetch("SELECT * FROM users ORDER BY created_at DESC")
+
+    async def get_stats(self):
+        row = await self.pool.fetchrow('''
+            SELECT
+                (SELECT COUNT(*) FROM users),
+                (SELECT COALESCE(SUM(balance), 0) FROM users),
+                (SELECT COALESCE(SUM(amount), 0) FROM transactions
+                 WHERE type IN ('game_lose', 'click'))
+        ''')
+        return {
+            'total_users': row[0],
+            'total_balance': int(row[1]),
+            'total_income': int(row[2])
+        }
+
+    async def get_ledger_mismatches(self):
+        """Пользователи, чей баланс не совпадает с суммой транзакций"""
+        return await self.pool.fetch('''
+            SELECT u.user_id, u.balance, COALESCE(SUM(t.amount), 0) AS ledger
+            FROM users u
+            LEFT JOIN transactions t ON t.user_id = u.user_id
+            GROUP BY u.user_id
+            HAVING u.balance != COALESCE(SUM(t.amount), 0)
+        ''')
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import hmac
+import secrets
+import struct
+from collections import OrderedDict, deque
+from config import Config
+from games import play_round
+
+# Из одного HMAC-SHA256 получается 4 числа по 53 бита
+VALUES_PER_BLOCK = 4
+_SCALE = 2.0 ** -53
+
+
+def new_server_seed() -> str:
+    return secrets.token_hex(32)
+
+
+def new_client_seed() -> str:
+    return secrets.token_hex(8)
+
+
+def seed_hash(server_seed: str) -> str:
+    """Публикуемый заранее хеш серверного сида"""
+    return hashlib.sha256(server_seed.encode()).hexdigest()
+
+
+def derive_block(server_seed: str, client_seed: str, nonce: int, block: int = 0):
+    """Числа [0, 1) для ставки: HMAC-SHA256(server_seed, "client_seed:nonce:block")"""
+    digest = hmac.new(
+        server_seed.encode(),
+        f"{client_seed}:{nonce}:{block}".encode(),
+        hashlib.sha256
+    ).digest()
+    return [(x >> 11) * _SCALE for x in struct.unpack(f">{VALUES_PER_BLOCK}Q", digest)]
+
+
+class BetRandom:
+    """Источник случайности одной ставки с интерфейсом модуля random.
+
+    Значения детерминированы (server_seed, client_seed, nonce), поэтому
+    исход можно воспроизвести после раскрытия серверного сида.
+    """
+
+    def __init__(self, server_seed: str, client_seed: str, nonce: int, first_block=None):
+        self.server_seed = server_seed
+        self.client_seed = client_seed
+        self.nonce = nonce
+        self._values = deque(first_block) if first_block is not None else deque()
+        self._block = 1 if first_block is not None else 0
+
+    def random(self) -> float:
+        if not self._values:
+            self._values.extend(derive_block(self.server_seed, self.client_seed, self.nonce, self._block))
+            self._block += 1
+        return self._values.popleft()
+
+    def randint(self, a: int, b: int) -> int:
+        return a + int(self.random() * (b - a + 1))
+
+    def uniform(self, a: float, b: float) -> float:
+        return a + (b - a) * self.random()
+
+
+class FairStream:
+    """Поток ставок пользователя по активному сиду.
+
+    Первые блоки чисел для следующих ставок считаются пачками заранее.
+    Нонсы резервируются в БД блоками, чтобы не писать счетчик на каждую
+    ставку; после перезапуска поток продолжает с конца резерва.
+    """
+
+    def __init__(self, seed_id: int, server_seed: str, client_seed: str, nonce: int, reserved: int):
+        self.seed_id = seed_id
+        self.server_seed = server_seed
+        self.client_seed = client_seed
+        self.nonce = nonce
+        self.reserved = reserved
+        self.lock = asyncio.Lock()
+        self._buffer = deque()
+
+    def _fill(self, count: int):
+        start = self.nonce + len(self._buffer)
+        self._buffer.extend(
+            derive_block(self.server_seed, self.client_seed, nonce)
+            for nonce in range(start, start + count)
+        )
+
+    def take(self, count: int, buffer_size: int = Config.RNG_BUFFER):
+        """Следующие count ставок: список BetRandom"""
+        if len(self._buffer) < count:
+            self._fill(max(count, buffer_size) - len(self._buffer))
+        bets = []
+        for _ in range(count):
+            bets.append(BetRandom(self.server_seed, self.client_seed, self.nonce, self._buffer.popleft()))
+            self.nonce += 1
+        return bets
+
+
+class FairRng:
+    """Доказуемо честный ГСЧ игр: сиды пользователей, резерв нонсов, ротация"""
+
+    def __init__(self, db, reserve: int = Config.RNG_NONCE_RESERVE, cache_size: int = Config.RNG_STREAMS_CACHE):
+        self.db = db
+        self.reserve = reserve
+        self.cache_size = cache_size
+        self.streams = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    async def stream(self, user_id: int) -> FairStream:
+        stream = self.streams.get(user_id)
+        if stream is not None:
+            self.streams.move_to_end(user_id)
+            return stream
+
+        async with self._lock:
+            stream = self.streams.get(user_id)
+            if stream is None:
+                row = await self.db.get_rng_seed(user_id)
+                if row is None:
+                    server_seed = new_server_seed()
+                    await self.db.create_rng_seed(
+                        user_id, server_seed, seed_hash(server_seed), new_client_seed()
+                    )
+                    row = await self.db.get_rng_seed(user_id)
+                seed_id, _, server_seed, _, client_seed, reserved = row[:6]
+                # Нонсы до конца прошлого резерва могли быть выданы до перезапуска
+                stream = FairStream(seed_id, server_seed, client_seed, reserved, reserved)
+                self.streams[user_id] = stream
+                if len(self.streams) > self.cache_size:
+                    self.streams.popitem(last=False)
+            return stream
+
+    async def next_bets(self, user_id: int, count: int = 1):
+        stream = await self.stream(user_id)
+        async with stream.lock:
+            if stream.nonce + count > stream.reserved:
+                stream.reserved = stream.nonce + count + self.reserve
+                await self.db.reserve_rng_nonces(stream.seed_id, stream.reserved)
+            return stream.take(count)
+
+    async def info(self, user_id: int) -> dict:
+        stream = await self.stream(user_id)
+        return {
+            'server_seed_hash': seed_hash(stream.server_seed),
+            'client_seed': stream.client_seed,
+            'nonce': stream.nonce
+        }
+
+    async def rotate(self, user_id: int, client_seed: str = None) -> dict:
+        """Раскрытие текущего серверного сида и переход на новый"""
+        stream = await self.stream(user_id)
+        async with stream.lock:
+            server_seed = new_server_seed()
+            await self.db.rotate_rng_seed(
+                stream.seed_id, user_id, server_seed, seed_hash(server_seed),
+                client_seed or new_client_seed()
+            )
+            self.streams.pop(user_id, None)
+        revealed = {
+            'server_seed': stream.server_seed,
+            'server_seed_hash': seed_hash(stream.server_seed),
+            'client_seed': stream.client_seed,
+            'last_nonce': stream.nonce - 1
+        }
+        return {'revealed': revealed, 'next': await self.info(user_id)}
+
+
+def verify(server_seed: str, client_seed: str, nonce: int, game_type: str, bet: int):
+    """Повтор исхода ставки по раскрытому сиду"""
+    return play_round(game_type, bet, BetRandom(server_seed, client_seed, nonce))
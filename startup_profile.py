@@ -0,0 +1,56 @@
+"""Профиль холодного старта: разбор `python -X importtime` по модулям.
+
+    python startup_profile.py main web_app --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def import_profile(module: str):
+    """Запуск чистого интерпретатора с -X importtime; (модуль, self мкс, cumulative мкс)"""
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", "0:profile")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def top_level(rows):
+    """Суммарное время по пакетам верхнего уровня"""
+    totals = {}
+    for name, self_us, _ in rows:
+        package = name.split(".")[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=["main", "web_app"])
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        rows = import_profile(module)
+        total = next(c for name, _, c in rows if name == module)
+        print(f"{module}: {total / 1000:.1f} ms")
+        for package, self_us in top_level(rows)[:args.top]:
+            print(f"  {package:<30} {self_us / 1000:8.1f} ms")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from config import Config
+from money import Money
+
+# Событие журнала, которое получают подписчики после коммита транзакции.
+# source_id - пользователь, действие которого вызвало начисление (реферал),
+# balance - баланс после изменения, если он известен,
+# count - число операций (ставок), сведенных в одну строку журнала.
+LedgerEvent = namedtuple('LedgerEvent', 'user_id amount type source_id created_at balance count',
+                         defaults=(None, 1))
+
+# Допустимые переходы статусов заявки на вывод.
+# hold - заявка удержана антифродом до ручной проверки.
+WITHDRAWAL_TRANSITIONS = {
+    'hold': ('pending', 'rejected'),
+    'pending': ('approved', 'rejected'),
+    'approved': ('paid', 'rejected'),
+}
+
+
+# Открытые заявки - очередь админа. Условие совпадает с частичным индексом
+# очереди в обоих хранилищах, поэтому подставляется в SQL литералами.
+OPEN_WITHDRAWAL_STATUSES = ('pending', 'hold')
+OPEN_WITHDRAWALS_WHERE = "status IN ('pending', 'hold')"
+
+
+def withdrawal_sources(status: str):
+    """Статусы, из которых разрешен переход в status"""
+    sources = [s for s, targets in WITHDRAWAL_TRANSITIONS.items() if status in targets]
+    if not sources:
+        raise ValueError(f"Unknown withdrawal status: {status}")
+    return sources
+
+
+class StorageBackend(ABC):
+    """Интерфейс хранилища. Строки возвращаются в порядке колонок таблиц,
+    денежные суммы - в милли-STAR (см. money.py).
+    """
+
+    def __init__(self):
+        self.listeners = []
+
+    def subscribe(self, listener):
+        """Подписка на события журнала транзакций"""
+        self.listeners.append(listener)
+
+    def _publish(self, event: LedgerEvent):
+        for listener in self.listeners:
+            listener(event)
+
+    @abstractmethod
+    async def init_db(self): ...
+
+    async def close(self):
+        pass
+
+    # Пользователи
+    @abstractmethod
+    async def get_user(self, user_id: int): ...
+
+    @abstractmethod
+    async def create_user(self, user_id: int, username: str, referrer_id: int = None) -> bool:
+        """Регистрация; False, если пользователь уже существует"""
+
+    @abstractmethod
+    async def claim_click(self, user_id: int, now: int, cooldown: int) -> bool:
+        """Отметка клика, если кулдаун истек; False, если клик уже был"""
+
+    @abstractmethod
+    async def update_balance(self, user_id: int, amount: Money): ...
+
+    @abstractmethod
+    async def get_balances(self, user_ids):
+        """Словарь user_id -> баланс для перечисленных пользователей"""
+
+    @abstractmethod
+    async def add_transaction(self, user_id: int, amount: Money, type: str, description: str = ""): ...
+
+    @abstractmethod
+    async def add_transactions(self, rows):
+        """Пакетная запись строк (user_id, amount, type, description) в журнал"""
+
+    @abstractmethod
+    async def credit(self, user_id: int, amount: Money, type: str, description: str = "",
+                     source_id: int = None): ...
+
+    @abstractmethod
+    async def settle_bets(self, user_id: int, rows, required: Money):
+        """Расчет серии ставок одной транзакцией.
+
+        rows - сводные строки журнала (amount, type, description, count).
+        Баланс меняется на сумму строк, только если он не меньше required.
+        Возвращает новый баланс или None, если средств недостаточно.
+        """
+
+    # Спонсоры
+    @abstractmethod
+    async def get_sponsors(self): ...
+
+    @abstractmethod
+    async def add_sponsor(self, channel_username: str, channel_id: str, channel_url: str): ...
+
+    @abstractmethod
+    async def delete_sponsor(self, sponsor_id: int): ...
+
+    @abstractmethod
+    async def update_user_sponsor(self, user_id: int, sponsor_id: int, is_subscribed: bool): ...
+
+    @abstractmethod
+    async def get_user_sponsors_status(self, user_id: int): ...
+
+    # Рефералы
+    @abstractmethod
+    async def get_user_referrals(self, user_id: int): ...
+
+    @abstractmethod
+    async def pay_referral_bonus(self, user_id: int, referrer_amount: Money, referee_amount: Money,
+                                 referrer_description: str, referee_description: str):
+        """Однократные бонусы рефереру и приглашенному одной транзакцией.
+
+        Возвращает referrer_id или None, если реферера нет или бонус уже выплачен.
+        """
+
+    # Выводы
+    @abstractmethod
+    async def create_withdrawal(self, user_id: int, amount: Money, status: str = 'pending'): ...
+
+    @abstractmethod
+    async def request_withdrawal(self, user_id: int, amount: Money, status: str = 'pending',
+                                 request_key: str = None, priority: int = 0): ...
+
+    @abstractmethod
+    async def get_withdrawal_queue(self, statuses=OPEN_WITHDRAWAL_STATUSES, limit: int = 100): ...
+
+    @abstractmethod
+    async def get_withdrawals(self, status: str = None, limit: int = 50, offset: int = 0):
+        """Страница истории заявок, новые первыми"""
+
+    @abstractmethod
+    async def set_withdrawals_status(self, withdrawal_ids, status: str): ...
+
+    async def update_withdrawal_status(self, withdrawal_id: int, status: str):
+        return bool(await self.set_withdrawals_status([withdrawal_id], status))
+
+    # Антифрод
+    @abstractmethod
+    async def flag_user(self, user_id: int, reason: str): ...
+
+    @abstractmethod
+    async def get_user_flag(self, user_id: int): ...
+
+    @abstractmethod
+    async def unflag_user(self, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def get_flagged_users(self):
+        """Флаги для админа: (user_id, reason, created_at), новые первыми"""
+
+    # Сиды ГСЧ
+    @abstractmethod
+    async def get_rng_seed(self, user_id: int):
+        """Активный сид: (id, user_id, server_seed, server_seed_hash, client_seed, nonce_reserved, ...)"""
+
+    @abstractmethod
+    async def create_rng_seed(self, user_id: int, server_seed: str, server_seed_hash: str,
+                              client_seed: str): ...
+
+    @abstractmethod
+    async def reserve_rng_nonces(self, seed_id: int, nonce_reserved: int): ...
+
+    @abstractmethod
+    async def rotate_rng_seed(self, seed_id: int, user_id: int, server_seed: str,
+                              server_seed_hash: str, client_seed: str):
+        """Раскрытие сида seed_id и создание нового активного сида одной транзакцией"""
+
+    # Админ
+    @abstractmethod
+    async def get_all_users(self): ...
+
+    @abstractmethod
+    async def get_stats(self): ...
+
+    @abstractmethod
+    async def get_ledger_mismatches(self): ...
+
+
+def create_database(url: str = None) -> StorageBackend:
+    """Хранилище по DATABASE_URL: postgres://... или файл SQLite"""
+    url = url if url is not None else Config.DATABASE_URL
+    if url and url.startswith(("postgres://", "postgresql://")):
+        from pg_database import PostgresDatabase
+        return PostgresDatabase(url)
+
+    from database import Database
+    return Database(url or Config.DB_PATH)
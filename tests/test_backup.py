@@ -0,0 +1,58 @@
+"""Снимки BackupService не блокируют запись в базу"""
+import asyncio
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup import BackupService  # noqa: E402
+from database import Database  # noqa: E402
+
+
+def test_write_commits_while_snapshot_runs(tmp_path):
+    db_path = str(tmp_path / "bot.db")
+    asyncio.run(Database(db_path).init_db())
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, ?, ?)",
+        ((i, 1000, "click", "x" * 200) for i in range(20000))
+    )
+    conn.commit()
+    conn.close()
+
+    writes = []
+
+    def write_once():
+        # Вызывается из обработчика прогресса, пока VACUUM INTO держит чтение
+        if writes:
+            return 0
+        writer = sqlite3.connect(db_path, timeout=0.2)
+        try:
+            writer.execute("INSERT INTO users (user_id, username) VALUES (1, 'writer')")
+            writer.commit()
+            writes.append("ok")
+        except sqlite3.OperationalError as e:
+            writes.append(str(e))
+        finally:
+            writer.close()
+        return 0
+
+    class WritingBackupService(BackupService):
+        @staticmethod
+        def _vacuum_into(connect, source_path, target_path):
+            def connect_with_writer(path):
+                conn = connect(path)
+                conn.set_progress_handler(write_once, 1000)
+                return conn
+            BackupService._vacuum_into(connect_with_writer, source_path, target_path)
+
+    service = WritingBackupService(db_path, str(tmp_path / "backups"), 3600, 5, 60)
+    path = asyncio.run(service.snapshot())
+
+    assert writes == ["ok"]
+    assert asyncio.run(service.verify(path))
+    assert sorted(os.listdir(tmp_path / "backups")) == [
+        os.path.basename(path),
+        os.path.basename(path) + ".sha256",
+    ]
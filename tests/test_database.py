@@ -0,0 +1,254 @@
+"""Проверка Database (SQLite) на временном файле"""
+import asyncio
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SCHEMA_VERSION, Database  # noqa: E402
+
+# Схема до перевода денег в милли-STAR: суммы в STAR типа REAL
+BASELINE_SCHEMA = [
+    '''CREATE TABLE users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        balance REAL DEFAULT 0.0,
+        referrer_id INTEGER DEFAULT NULL,
+        last_click INTEGER DEFAULT NULL,
+        created_at INTEGER DEFAULT (strftime('%s', 'now'))
+    )''',
+    '''CREATE TABLE sponsors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_username TEXT NOT NULL,
+        channel_id TEXT NOT NULL,
+        channel_url TEXT NOT NULL
+    )''',
+    '''CREATE TABLE user_sponsors (
+        user_id INTEGER,
+        sponsor_id INTEGER,
+        is_subscribed BOOLEAN DEFAULT 0,
+        PRIMARY KEY (user_id, sponsor_id)
+    )''',
+    '''CREATE TABLE withdrawals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        amount REAL,
+        status TEXT DEFAULT 'pending',
+        created_at INTEGER DEFAULT (strftime('%s', 'now'))
+    )''',
+    '''CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        amount REAL,
+        type TEXT,
+        description TEXT,
+        created_at INTEGER DEFAULT (strftime('%s', 'now'))
+    )''',
+]
+
+
+def run(path, test):
+    """Запуск теста test(db, events) на базе в файле path"""
+    async def main():
+        db = Database(str(path))
+        events = []
+        db.subscribe(events.append)
+        await db.init_db()
+        await test(db, events)
+
+    asyncio.run(main())
+
+
+async def ledger(db, user_id):
+    conn = sqlite3.connect(db.db_path)
+    try:
+        return conn.execute(
+            "SELECT amount, type FROM transactions WHERE user_id = ? ORDER BY id",
+            (user_id,)
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_migrates_baseline_real_amounts(tmp_path):
+    path = tmp_path / "baseline.db"
+    conn = sqlite3.connect(path)
+    for statement in BASELINE_SCHEMA:
+        conn.execute(statement)
+    conn.execute("INSERT INTO users (user_id, username, balance) VALUES (1, 'alice', ?)", (0.1 + 0.2 + 20.0 - 15.0,))
+    conn.execute("INSERT INTO users (user_id, username, referrer_id) VALUES (2, 'bob', 1)")
+    conn.executemany(
+        "INSERT INTO transactions (user_id, amount, type, description) VALUES (1, ?, ?, '')",
+        [(0.1, "click"), (0.2, "click"), (20.0, "game_win"), (-15.0, "withdrawal")]
+    )
+    conn.execute("INSERT INTO withdrawals (user_id, amount) VALUES (1, 15.0)")
+    conn.commit()
+    conn.close()
+
+    async def test(db, events):
+        assert (await db.get_user(1))[2] == 5300
+        assert await ledger(db, 1) == [(100, "click"), (200, "click"), (20000, "game_win"), (-15000, "withdrawal")]
+        assert await db.get_ledger_mismatches() == []
+
+        withdrawal = (await db.get_withdrawals())[0]
+        assert withdrawal[2] == 15000
+        assert await db.set_withdrawals_status([withdrawal[0]], 'rejected') == [withdrawal[0]]
+        assert (await db.get_user(1))[2] == 20300
+        assert await db.get_ledger_mismatches() == []
+
+        # Бонус уже зарегистрированного реферала не выплачивается после обновления
+        assert await db.pay_referral_bonus(2, 3000, 2000, "r", "e") is None
+
+    run(path, test)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert [row[2] for row in conn.execute("PRAGMA table_info(users)")][2] == "INTEGER"
+    conn.close()
+
+
+def test_credit_updates_balance_and_ledger(tmp_path):
+    async def test(db, events):
+        assert await db.create_user(1, "alice")
+        assert not await db.create_user(1, "alice")
+
+        await db.credit(1, 1500, "click", "Кликер")
+        await db.credit(1, -500, "game_lose", "Проигрыш")
+
+        assert (await db.get_user(1))[2] == 1000
+        assert await ledger(db, 1) == [(1500, "click"), (-500, "game_lose")]
+        assert [(e.amount, e.balance) for e in events] == [(1500, 1500), (-500, 1000)]
+        assert await db.get_ledger_mismatches() == []
+
+    run(tmp_path / "bot.db", test)
+
+
+def test_settle_bets_guards_required_balance(tmp_path):
+    async def test(db, events):
+        await db.create_user(1, "alice")
+        await db.credit(1, 10000, "click")
+        rows = [
+            (3000, "game_win", "Выигрыши", 2),
+            (-5000, "game_lose", "Проигрыши", 3),
+        ]
+
+        assert await db.settle_bets(1, rows, 20000) is None
+        assert (await db.get_user(1))[2] == 10000
+
+        assert await db.settle_bets(1, rows, 10000) == 8000
+        assert await ledger(db, 1) == [(10000, "click"), (3000, "game_win"), (-5000, "game_lose")]
+        assert [(e.type, e.count, e.balance) for e in events[1:]] == [
+            ("game_win", 2, 8000),
+            ("game_lose", 3, 8000),
+        ]
+
+    run(tmp_path / "bot.db", test)
+
+
+def test_request_withdrawal_debits_once_per_key(tmp_path):
+    async def test(db, events):
+        await db.create_user(1, "alice")
+        await db.credit(1, 20000, "click")
+
+        assert await db.request_withdrawal(1, 50000, request_key="tg:0") is None
+
+        withdrawal_id, created = await db.request_withdrawal(1, 15000, request_key="tg:1")
+        assert created
+        assert await db.request_withdrawal(1, 15000, request_key="tg:1") == (withdrawal_id, False)
+        assert (await db.get_user(1))[2] == 5000
+        assert await db.get_ledger_mismatches() == []
+
+    run(tmp_path / "bot.db", test)
+
+
+def test_request_withdrawal_concurrent_duplicate_key(tmp_path):
+    async def test(db, events):
+        await db.create_user(1, "alice")
+        await db.credit(1, 20000, "click")
+
+        results = await asyncio.gather(*(
+            db.request_withdrawal(1, 5000, request_key="tg:same") for _ in range(4)
+        ))
+
+        assert len({withdrawal_id for withdrawal_id, _ in results}) == 1
+        assert sum(created for _, created in results) == 1
+        assert (await db.get_user(1))[2] == 15000
+        assert await db.get_ledger_mismatches() == []
+
+    run(tmp_path / "bot.db", test)
+
+
+def test_set_withdrawals_status_transitions_and_refunds(tmp_path):
+    async def test(db, events):
+        for user_id in (1, 2):
+            await db.create_user(user_id, f"user{user_id}")
+            await db.credit(user_id, 10000, "click")
+        first, _ = await db.request_withdrawal(1, 4000)
+        second, _ = await db.request_withdrawal(2, 6000, status='hold')
+        third, _ = await db.request_withdrawal(1, 1000)
+
+        assert await db.set_withdrawals_status([first, second], 'approved') == [first]
+        assert sorted(await db.set_withdrawals_status([first, second, third], 'rejected')) == sorted(
+            [first, second, third]
+        )
+        assert await db.set_withdrawals_status([first], 'paid') == []
+
+        assert (await db.get_user(1))[2] == 10000
+        assert (await db.get_user(2))[2] == 10000
+        assert await db.get_ledger_mismatches() == []
+        refunds = [e for e in events if e.type == "withdrawal_refund"]
+        assert sorted((e.user_id, e.amount) for e in refunds) == [(1, 1000), (1, 4000), (2, 6000)]
+
+        with pytest.raises(ValueError):
+            await db.set_withdrawals_status([first], 'unknown')
+
+    run(tmp_path / "bot.db", test)
+
+
+def test_pay_referral_bonus_once(tmp_path):
+    async def test(db, events):
+        await db.create_user(1, "referrer")
+        await db.create_user(2, "referee", referrer_id=1)
+        await db.create_user(3, "organic")
+
+        assert await db.pay_referral_bonus(3, 3000, 2000, "r", "e") is None
+        assert await db.pay_referral_bonus(2, 3000, 2000, "r", "e") == 1
+        assert await db.pay_referral_bonus(2, 3000, 2000, "r", "e") is None
+
+        assert (await db.get_user(1))[2] == 3000
+        assert (await db.get_user(2))[2] == 2000
+        assert [(e.user_id, e.source_id, e.balance) for e in events] == [(1, 2, 3000), (2, None, 2000)]
+        assert await db.get_ledger_mismatches() == []
+
+    run(tmp_path / "bot.db", test)
+
+
+def test_withdrawal_queue_uses_partial_index(tmp_path):
+    async def test(db, events):
+        await db.create_user(1, "alice")
+        await db.credit(1, 100000, "click")
+        low, _ = await db.request_withdrawal(1, 1000)
+        held, _ = await db.request_withdrawal(1, 1000, status='hold', priority=-1)
+        high, _ = await db.request_withdrawal(1, 1000, priority=1)
+        await db.set_withdrawals_status([low], 'approved')
+
+        assert [row[0] for row in await db.get_withdrawal_queue()] == [high, held]
+        assert [row[0] for row in await db.get_withdrawal_queue(('approved',))] == [low]
+        assert [row[0] for row in await db.get_withdrawals(limit=2)] == [high, held]
+        assert [row[0] for row in await db.get_withdrawals(limit=2, offset=2)] == [low]
+
+    path = tmp_path / "bot.db"
+    run(path, test)
+
+    conn = sqlite3.connect(path)
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM withdrawals w "
+        "WHERE w.status IN ('pending', 'hold') ORDER BY w.priority DESC, w.id LIMIT 100"
+    ).fetchall()
+    conn.close()
+    details = " ".join(row[3] for row in plan)
+    assert "idx_withdrawals_open" in details
+    assert "TEMP B-TREE" not in details
@@ -0,0 +1,173 @@
+"""Проверка PostgresDatabase на локальном PostgreSQL.
+
+Запуск: TEST_DATABASE_URL=postgresql://user@localhost/test python -m pytest tests
+Каждый тест работает в своей временной схеме, которая удаляется после теста.
+"""
+import asyncio
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+asyncpg = pytest.importorskip("asyncpg")
+
+from pg_database import PostgresDatabase  # noqa: E402
+
+DSN = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not DSN, reason="TEST_DATABASE_URL is not set")
+
+
+def run(test):
+    """Запуск теста test(db, events) на чистой схеме"""
+    async def main():
+        schema = f"test_{uuid.uuid4().hex}"
+        admin = await asyncpg.connect(DSN)
+        await admin.execute(f"CREATE SCHEMA {schema}")
+        try:
+            pool = await asyncpg.create_pool(
+                DSN, min_size=1, max_size=4,
+                server_settings={'search_path': schema}
+            )
+            db = PostgresDatabase(pool=pool)
+            events = []
+            db.subscribe(events.append)
+            try:
+                await db.init_db()
+                await test(db, events)
+            finally:
+                await db.close()
+        finally:
+            await admin.execute(f"DROP SCHEMA {schema} CASCADE")
+            await admin.close()
+
+    asyncio.run(main())
+
+
+async def ledger(db, user_id):
+    return [
+        (row['amount'], row['type'])
+        for row in await db.pool.fetch(
+            "SELECT amount, type FROM transactions WHERE user_id = $1 ORDER BY id",
+            user_id
+        )
+    ]
+
+
+def test_credit_updates_balance_and_ledger():
+    async def test(db, events):
+        assert await db.create_user(1, "alice")
+        assert not await db.create_user(1, "alice")
+
+        await db.credit(1, 1500, "click", "Кликер")
+        await db.credit(1, -500, "game_lose", "Проигрыш")
+
+        assert (await db.get_user(1))[2] == 1000
+        assert await ledger(db, 1) == [(1500, "click"), (-500, "game_lose")]
+        assert [(e.amount, e.balance) for e in events] == [(1500, 1500), (-500, 1000)]
+        assert await db.get_ledger_mismatches() == []
+
+    run(test)
+
+
+def test_settle_bets_guards_required_balance():
+    async def test(db, events):
+        await db.create_user(1, "alice")
+        await db.credit(1, 10000, "click")
+        rows = [
+            (3000, "game_win", "Выигрыши", 2),
+            (-5000, "game_lose", "Проигрыши", 3),
+        ]
+
+        assert await db.settle_bets(1, rows, 20000) is None
+        assert (await db.get_user(1))[2] == 10000
+
+        assert await db.settle_bets(1, rows, 10000) == 8000
+        assert await ledger(db, 1) == [(10000, "click"), (3000, "game_win"), (-5000, "game_lose")]
+        assert [(e.type, e.count, e.balance) for e in events[1:]] == [
+            ("game_win", 2, 8000),
+            ("game_lose", 3, 8000),
+        ]
+
+    run(test)
+
+
+def test_request_withdrawal_debits_once_per_key():
+    async def test(db, events):
+        await db.create_user(1, "alice")
+        await db.credit(1, 20000, "click")
+
+        assert await db.request_withdrawal(1, 50000, request_key="tg:0") is None
+
+        withdrawal_id, created = await db.request_withdrawal(1, 15000, request_key="tg:1")
+        assert created
+        assert await db.request_withdrawal(1, 15000, request_key="tg:1") == (withdrawal_id, False)
+        assert (await db.get_user(1))[2] == 5000
+        assert await db.get_ledger_mismatches() == []
+
+    run(test)
+
+
+def test_request_withdrawal_concurrent_duplicate_key():
+    async def test(db, events):
+        await db.create_user(1, "alice")
+        await db.credit(1, 20000, "click")
+
+        results = await asyncio.gather(*(
+            db.request_withdrawal(1, 5000, request_key="tg:same") for _ in range(4)
+        ))
+
+        assert len({withdrawal_id for withdrawal_id, _ in results}) == 1
+        assert sum(created for _, created in results) == 1
+        assert (await db.get_user(1))[2] == 15000
+        assert await db.get_ledger_mismatches() == []
+
+    run(test)
+
+
+def test_set_withdrawals_status_transitions_and_refunds():
+    async def test(db, events):
+        for user_id in (1, 2):
+            await db.create_user(user_id, f"user{user_id}")
+            await db.credit(user_id, 10000, "click")
+        first, _ = await db.request_withdrawal(1, 4000)
+        second, _ = await db.request_withdrawal(2, 6000, status='hold')
+        third, _ = await db.request_withdrawal(1, 1000)
+
+        assert await db.set_withdrawals_status([first, second], 'approved') == [first]
+        assert sorted(await db.set_withdrawals_status([first, second, third], 'rejected')) == sorted(
+            [first, second, third]
+        )
+        assert await db.set_withdrawals_status([first], 'paid') == []
+
+        assert (await db.get_user(1))[2] == 10000
+        assert (await db.get_user(2))[2] == 10000
+        assert await db.get_ledger_mismatches() == []
+        refunds = [e for e in events if e.type == "withdrawal_refund"]
+        assert sorted((e.user_id, e.amount) for e in refunds) == [(1, 1000), (1, 4000), (2, 6000)]
+
+        with pytest.raises(ValueError):
+            await db.set_withdrawals_status([first], 'unknown')
+
+    run(test)
+
+
+def test_pay_referral_bonus_once():
+    async def test(db, events):
+        await db.create_user(1, "referrer")
+        await db.create_user(2, "referee", referrer_id=1)
+        await db.create_user(3, "organic")
+
+        assert await db.pay_referral_bonus(3, 3000, 2000, "r", "e") is None
+        assert await db.pay_referral_bonus(2, 3000, 2000, "r", "e") == 1
+        assert await db.pay_referral_bonus(2, 3000, 2000, "r", "e") is None
+
+        assert (await db.get_user(1))[2] == 3000
+        assert (await db.get_user(2))[2] == 2000
+        assert [(e.user_id, e.source_id, e.balance) for e in events] == [(1, 2, 3000), (2, None, 2000)]
+        assert await db.get_ledger_mismatches() == []
+
+    run(test)
@@ -0,0 +1,31 @@
+"""Обработчики вызывают у db только методы интерфейса StorageBackend"""
+import ast
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import StorageBackend  # noqa: E402
+
+
+def db_attributes(filename):
+    with open(os.path.join(ROOT, filename), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    return {
+        node.attr
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Attribute)
+        and isinstance(node.value, ast.Name)
+        and node.value.id == "db"
+    }
+
+
+@pytest.mark.parametrize("filename", ["main.py", "web_app.py"])
+def test_handlers_use_declared_methods(filename):
+    missing = {name for name in db_attributes(filename) if not hasattr(StorageBackend, name)}
+    # Путь к файлу SQLite нужен только фоновым снимкам бота
+    missing.discard("db_path")
+    assert not missing
@@ -0,0 +1,272 @@
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections import namedtuple
+from config import Config
+
+# Снимок горячих данных пользователя; баланс в милли-STAR
+UserState = namedtuple('UserState', 'user_id balance referrer_id last_click')
+
+_MAGIC = b'MSSTATE1'
+_HEADER = struct.Struct('<8sQ')
+
+# Биты колонки flags
+_SUBSCRIBED_KNOWN = 1
+_SUBSCRIBED = 2
+_REFERRALS_KNOWN = 4
+
+_MASK64 = (1 << 64) - 1
+
+
+class _SlotIndex:
+    """Открытая адресация user_id -> номер строки в двух массивах.
+
+    Около 24 байт на пользователя вместо сотен байт у dict с объектами int.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.keys = array('q', bytes(8 * capacity))
+        self.slots = array('i', bytes(4 * capacity))
+        self.size = 0
+
+    def _find(self, key: int) -> int:
+        mask = len(self.keys) - 1
+        i = ((key * 0x9E3779B97F4A7C15) & _MASK64) >> 32 & mask
+        keys = self.keys
+        while keys[i] != key and keys[i] != 0:
+            i = (i + 1) & mask
+        return i
+
+    def get(self, key: int) -> int:
+        i = self._find(key)
+        return self.slots[i] if self.keys[i] == key else -1
+
+    def set(self, key: int, slot: int):
+        if (self.size + 1) * 2 > len(self.keys):
+            self._grow()
+        i = self._find(key)
+        if self.keys[i] == 0:
+            self.keys[i] = key
+            self.size += 1
+        self.slots[i] = slot
+
+    def _grow(self):
+        keys, slots = self.keys, self.slots
+        self.keys = array('q', bytes(16 * len(keys)))
+        self.slots = array('i', bytes(8 * len(keys)))
+        self.size = 0
+        for key, slot in zip(keys, slots):
+            if key:
+                self.set(key, slot)
+
+
+class UserStateTable:
+    """Колоночная таблица горячего состояния пользователей на массивах array.
+
+    Строка живет ttl секунд с момента загрузки из БД; изменения баланса
+    в этом процессе применяются сразу, изменения из другого процесса
+    (бот/сайт) становятся видны после истечения ttl.
+    """
+
+    COLUMNS = (
+        ('user_ids', 'q'),
+        ('balances', 'q'),
+        ('referrers', 'q'),
+        ('last_clicks', 'q'),
+        ('loaded_at', 'I'),
+        ('ref_total', 'I'),
+        ('ref_active', 'I'),
+        ('flags', 'B'),
+    )
+
+    def __init__(self, ttl: int = Config.STATE_TTL):
+        self.ttl = ttl
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, array(typecode))
+        self.index = _SlotIndex()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def _slot(self, user_id: int, fresh: bool = True) -> int:
+        slot = self.index.get(user_id)
+        if slot < 0:
+            return -1
+        if fresh and time.time() - self.loaded_at[slot] > self.ttl:
+            return -1
+        return slot
+
+    def get(self, user_id: int):
+        slot = self._slot(user_id)
+        if slot < 0:
+            return None
+        return UserState(
+            user_id,
+            self.balances[slot],
+            self.referrers[slot] or None,
+            self.last_clicks[slot] or None
+        )
+
+    def put(self, user_id: int, balance: int, referrer_id: int = None, last_click: int = None):
+        """Строка из системы учета (БД); сбрасывает кешированные подписку и рефералов"""
+        slot = self.index.get(user_id)
+        if slot < 0:
+            slot = len(self.user_ids)
+            for name, _ in self.COLUMNS:
+                getattr(self, name).append(0)
+            self.user_ids[slot] = user_id
+            self.index.set(user_id, slot)
+        self.balances[slot] = balance
+        self.referrers[slot] = referrer_id or 0
+        self.last_clicks[slot] = last_click or 0
+        self.loaded_at[slot] = int(time.time())
+        self.flags[slot] = 0
+
+    def invalidate(self, user_id: int):
+        slot = self.index.get(user_id)
+        if slot >= 0:
+            self.loaded_at[slot] = 0
+
+    def set_balance(self, user_id: int, balance: int):
+        slot = self._slot(user_id, fresh=False)
+        if slot >= 0:
+            self.balances[slot] = balance
+
+    def set_last_click(self, user_id: int, last_click: int):
+        slot = self._slot(user_id, fresh=False)
+        if slot >= 0:
+            self.last_clicks[slot] = last_click
+
+    def subscribed(self, user_id: int):
+        """True/False, если подписка известна, иначе None"""
+        slot = self._slot(user_id)
+        if slot < 0 or not self.flags[slot] & _SUBSCRIBED_KNOWN:
+            return None
+        return bool(self.flags[slot] & _SUBSCRIBED)
+
+    def set_subscribed(self, user_id: int, subscribed: bool):
+        slot = self._slot(user_id, fresh=False)
+        if slot >= 0:
+            self.flags[slot] = (self.flags[slot] & ~_SUBSCRIBED) | _SUBSCRIBED_KNOWN | (
+                _SUBSCRIBED if subscribed else 0
+            )
+
+    def referrals(self, user_id: int):
+        """(всего, активных), если известны, иначе None"""
+        slot = self._slot(user_id)
+        if slot < 0 or not self.flags[slot] & _REFERRALS_KNOWN:
+            return None
+        return self.ref_total[slot], self.ref_active[slot]
+
+    def set_referrals(self, user_id: int, total: int, active: int):
+        slot = self._slot(user_id, fresh=False)
+        if slot >= 0:
+            self.ref_total[slot] = total
+            self.ref_active[slot] = active
+            self.flags[slot] |= _REFERRALS_KNOWN
+
+    def forget_referrals(self, user_id: int):
+        slot = self._slot(user_id, fresh=False)
+        if slot >= 0:
+            self.flags[slot] &= ~_REFERRALS_KNOWN
+
+    def save(self, path: str):
+        """Снимок колонок в файл для теплого перезапуска"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(self)))
+            for name, _ in self.COLUMNS:
+                getattr(self, name).tofile(f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """Загрузка снимка через mmap; False, если файла нет или он чужой"""
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return False
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            f.close()
+            return False
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, count = _HEADER.unpack_from(mm)
+            if magic != _MAGIC:
+                return False
+            offset = _HEADER.size
+            columns = {}
+            for name, typecode in self.COLUMNS:
+                column = array(typecode)
+                size = count * column.itemsize
+                column.frombytes(mm[offset:offset + size])
+                columns[name] = column
+                offset += size
+
+        for name, column in columns.items():
+            setattr(self, name, column)
+        # Время загрузки из снимка не переносится: иначе после простоя
+        # дольше ttl все строки сразу устаревают и теплый старт бесполезен
+        self.loaded_at = array('I', [int(time.time())]) * count
+        self.index = _SlotIndex(max(1024, 1 << (2 * count).bit_length()))
+        for slot, user_id in enumerate(self.user_ids):
+            self.index.set(user_id, slot)
+        return True
+
+
+class HotState:
+    """Основной путь чтения для обработчиков: таблица в памяти, БД - система учета"""
+
+    def __init__(self, db, table: UserStateTable = None):
+        self.db = db
+        self.table = table or UserStateTable()
+
+    async def user(self, user_id: int):
+        state = self.table.get(user_id)
+        if state is not None:
+            return state
+        row = await self.db.get_user(user_id)
+        if row is None:
+            return None
+        self.table.put(user_id, row[2], row[3], row[4])
+        return self.table.get(user_id)
+
+    async def fresh_user(self, user_id: int):
+        """Строка прямо из БД - для решений о деньгах"""
+        self.table.invalidate(user_id)
+        return await self.user(user_id)
+
+    async def is_subscribed(self, user_id: int) -> bool:
+        subscribed = self.table.subscribed(user_id)
+        if subscribed is not None:
+            return subscribed
+        sponsors = await self.db.get_user_sponsors_status(user_id)
+        subscribed = all(sponsor[4] for sponsor in sponsors)
+        if await self.user(user_id) is not None:
+            self.table.set_subscribed(user_id, subscribed)
+        return subscribed
+
+    async def referrals(self, user_id: int):
+        referrals = self.table.referrals(user_id)
+        if referrals is not None:
+            return referrals
+        total, active = await self.db.get_user_referrals(user_id)
+        if await self.user(user_id) is not None:
+            self.table.set_referrals(user_id, total, active)
+        return total, active
+
+    def on_ledger(self, event):
+        """Подписчик Database: баланс после изменения в этом процессе"""
+        if event.balance is not None:
+            self.table.set_balance(event.user_id, event.balance)
+        else:
+            self.table.invalidate(event.user_id)
+        if event.type == 'referral_bonus' and event.source_id is not None:
+            self.table.forget_referrals(event.user_id)
+
+    def load(self, path: str):
+        return self.table.load(path)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.table.save(path)
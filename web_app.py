@@ -3,18 +3,44 @@ import aiohttp_jinja2
 import jinja2
 import hashlib
 import hmac
-import random
+import asyncio
+import os
 import time
-from database import Database
+from storage import create_database, StorageBackend, WITHDRAWAL_TRANSITIONS
+from events import EventHub
+from fraud import FraudMonitor
 from config import Config
+from games import play_batch, play_round
+from rng import FairRng, verify as verify_round
+from money import from_stars, format_stars
+from user_state import HotState
 
-db = Database()
+# Сервисы приложения создаются в init_app и хранятся в app
+DB = web.AppKey("db", StorageBackend)
+FRAUD = web.AppKey("fraud", FraudMonitor)
+HUB = web.AppKey("hub", EventHub)
+HOT = web.AppKey("hot", HotState)
+RNG = web.AppKey("rng", FairRng)
+EVENTS_SYNC = web.AppKey("events_sync", asyncio.Task)
+
+WITHDRAWAL_STATUSES = {s for targets in WITHDRAWAL_TRANSITIONS.values() for s in targets}
+WITHDRAWALS_PAGE = 50
+
+def client_ip(request) -> str:
+    """IP клиента: из заголовка доверенного прокси, если он настроен"""
+    if Config.TRUSTED_IP_HEADER:
+        value = request.headers.get(Config.TRUSTED_IP_HEADER)
+        if value:
+            # В X-Forwarded-For последний адрес дописан нашим прокси
+            return value.split(",")[-1].strip()
+    return request.remote
 
 @aiohttp_jinja2.template('login.html')
 async def login_page(request):
     return {}
 
 async def login_handler(request):
+    db = request.app[DB]
     data = await request.post()
     
     # Проверка данных от Telegram Widget
@@ -52,151 +78,283 @@ async def login_handler(request):
 
 @aiohttp_jinja2.template('games.html')
 async def games_page(request):
+    hot = request.app[HOT]
     user_id = request.cookies.get('user_id')
     if not user_id:
         return web.HTTPFound('/')
     
-    user = await db.get_user(int(user_id))
+    user = await hot.user(int(user_id))
     if not user:
         return web.HTTPFound('/')
     
-    return {'balance': user[2], 'user_id': user_id}
+    return {'balance': format_stars(user.balance), 'user_id': user_id}
 
 @aiohttp_jinja2.template('profile.html')
 async def profile_page(request):
+    hot = request.app[HOT]
     user_id = request.cookies.get('user_id')
     if not user_id:
         return web.HTTPFound('/')
     
-    user = await db.get_user(int(user_id))
+    user = await hot.user(int(user_id))
     if not user:
         return web.HTTPFound('/')
     
-    total_ref, active_ref = await db.get_user_referrals(int(user_id))
+    total_ref, active_ref = await hot.referrals(int(user_id))
     
     return {
         'user_id': user_id,
-        'username': user[1],
-        'balance': user[2],
+        # Имя пользователя сохраняется в cookie при входе через Telegram
+        'username': request.cookies.get('username', f'user_{user_id}'),
+        'balance': format_stars(user.balance),
         'total_ref': total_ref,
         'active_ref': active_ref
     }
 
+def _format_withdrawal(row):
+    """Строка заявки (id, user_id, amount, ...) с суммой в STAR"""
+    return (row[0], row[1], format_stars(row[2]), *row[3:])
+
 @aiohttp_jinja2.template('admin.html')
 async def admin_page(request):
+    db = request.app[DB]
     user_id = request.cookies.get('user_id')
     if not user_id or int(user_id) != Config.ADMIN_ID:
         return web.HTTPFound('/')
     
+    # История заявок постранично: ?page=N, новые первыми
+    try:
+        page = max(int(request.query.get('page', 0)), 0)
+    except ValueError:
+        page = 0
+    
     stats = await db.get_stats()
     sponsors = await db.get_sponsors()
-    withdrawals = await db.get_withdrawals()
+    withdrawals = await db.get_withdrawals(limit=WITHDRAWALS_PAGE, offset=page * WITHDRAWALS_PAGE)
+    queue = await db.get_withdrawal_queue()
+    flagged = await db.get_flagged_users()
+    
+    # Суммы хранятся в милли-STAR; в шаблон передаются строки в STAR
+    stats = {
+        **stats,
+        'total_balance': format_stars(stats['total_balance']),
+        'total_income': format_stars(stats['total_income'])
+    }
     
     return {
         'stats': stats,
         'sponsors': sponsors,
-        'withdrawals': withdrawals
+        'withdrawals': [_format_withdrawal(w) for w in withdrawals],
+        'page': page,
+        'queue': [_format_withdrawal(w) for w in queue],
+        'flagged': flagged
     }
 
 async def play_game(request):
+    db = request.app[DB]
+    fraud = request.app[FRAUD]
+    hot = request.app[HOT]
+    rng = request.app[RNG]
     user_id = request.cookies.get('user_id')
     if not user_id:
         return web.json_response({'error': 'Not authorized'}, status=401)
     
+    fraud.observe_request(int(user_id), client_ip(request))
+    
     data = await request.json()
     game_type = data.get('game')
-    bet = float(data.get('bet', 0))
-    
-    user = await db.get_user(int(user_id))
-    if not user or user[2] < bet:
+    try:
+        bet = from_stars(data.get('bet', 0))
+    except ValueError:
+        return web.json_response({'error': 'Invalid bet'}, status=400)
+    if bet <= 0:
+        return web.json_response({'error': 'Invalid bet'}, status=400)
+    
+    user = await hot.user(int(user_id))
+    if user and user.balance < bet:
+        # Кеш мог не увидеть пополнение из бота
+        user = await hot.fresh_user(int(user_id))
+    if not user or user.balance < bet:
         return web.json_response({'error': 'Insufficient balance'}, status=400)
     
-    result = {}
+    bet_rng, = await rng.next_bets(int(user_id))
+    try:
+        result = play_round(game_type, bet, bet_rng)
+    except ValueError:
+        return web.json_response({'error': 'Unknown game'}, status=400)
+    result['nonce'] = bet_rng.nonce
     
-    if game_type == 'flip':
-        # Monkey Flip
-        choice = data.get('choice')
-        
-        # Специальное событие (1.5% шанс проигрыша)
-        if random.random() < Config.GAMES['flip']['special_event_chance']:
-            win = False
-            multiplier = 0
-        else:
-            win_chance = Config.GAMES['flip']['win_chance']
-            win = random.random() < win_chance
-            multiplier = Config.GAMES['flip']['multiplier'] if win else 0
-        
-        result = {
-            'win': win,
-            'multiplier': multiplier,
-            'amount': bet * multiplier if win else 0
-        }
-    
-    elif game_type == 'crash':
-        # Banana Crash
-        instant_crash = random.random() < Config.GAMES['crash']['instant_crash_chance']
-        
-        if instant_crash:
-            multiplier = 1.0
-            win = False
-        else:
-            # 2% шанс на высокий множитель
-            if random.random() < 0.02:
-                multiplier = random.uniform(1.5, 5.0)
-            else:
-                multiplier = random.uniform(*Config.GAMES['crash']['low_multiplier_range'])
-            
-            # Игрок должен успеть забрать (имитация)
-            player_cashout = random.uniform(1.0, multiplier * 0.8)
-            win = player_cashout > 1.0
-        
-        result = {
-            'win': win,
-            'multiplier': multiplier if win else 1.0,
-            'amount': bet * multiplier if win else 0
-        }
-    
-    elif game_type == 'slot':
-        # Слот
-        combinations = Config.GAMES['slot']['total_combinations']
-        winning_combos = Config.GAMES['slot']['winning_combinations']
-        
-        win = random.randint(1, combinations) <= winning_combos
-        multiplier = Config.GAMES['slot']['win_multiplier'] if win else 0
-        
-        result = {
-            'win': win,
-            'multiplier': multiplier,
-            'amount': bet * multiplier if win else 0
-        }
-    
-    # Обновляем баланс
+    # Обновляем баланс; баланс из кеша мог устареть, поэтому ставка
+    # окончательно проверяется в той же транзакции
     if result['win']:
-        await db.update_balance(int(user_id), result['amount'] - bet)
-        await db.add_transaction(
-            int(user_id),
+        row = (
             result['amount'] - bet,
             "game_win",
-            f"Выигрыш в {game_type}: x{result['multiplier']:.2f}"
+            f"Выигрыш в {game_type}: x{result['multiplier']:.2f} (nonce {bet_rng.nonce})",
+            1
         )
     else:
-        await db.update_balance(int(user_id), -bet)
-        await db.add_transaction(
-            int(user_id),
-            -bet,
-            "game_lose",
-            f"Проигрыш в {game_type}"
-        )
+        row = (-bet, "game_lose", f"Проигрыш в {game_type} (nonce {bet_rng.nonce})", 1)
     
-    # Получаем новый баланс
-    user = await db.get_user(int(user_id))
+    new_balance = await db.settle_bets(int(user_id), [row], bet)
+    if new_balance is None:
+        hot.table.invalidate(int(user_id))
+        return web.json_response({'error': 'Insufficient balance'}, status=400)
     
     return web.json_response({
         **result,
-        'new_balance': user[2]
+        'amount': format_stars(result['amount']),
+        'new_balance': format_stars(new_balance)
+    })
+
+async def play_batch_game(request):
+    """Серия ставок или авто-игра одним запросом и одной транзакцией.
+    
+    {"game": "flip", "bets": [1, 2, 5]} или
+    {"game": "slot", "bet": 1, "rounds": 100, "stop_loss": 20, "take_profit": 50}
+    """
+    db = request.app[DB]
+    fraud = request.app[FRAUD]
+    hot = request.app[HOT]
+    rng = request.app[RNG]
+    user_id = request.cookies.get('user_id')
+    if not user_id:
+        return web.json_response({'error': 'Not authorized'}, status=401)
+    user_id = int(user_id)
+    
+    fraud.observe_request(user_id, client_ip(request))
+    
+    data = await request.json()
+    game_type = data.get('game')
+    try:
+        if 'bets' in data:
+            bets = [from_stars(b) for b in data['bets'][:Config.GAMES_BATCH_MAX]]
+        else:
+            rounds = min(int(data.get('rounds', 1)), Config.GAMES_BATCH_MAX)
+            bets = [from_stars(data.get('bet', 0))] * rounds
+        stop_loss = from_stars(data['stop_loss']) if data.get('stop_loss') else None
+        take_profit = from_stars(data['take_profit']) if data.get('take_profit') else None
+    except (TypeError, ValueError):
+        return web.json_response({'error': 'Invalid bet'}, status=400)
+    if not bets or any(b <= 0 for b in bets):
+        return web.json_response({'error': 'Invalid bet'}, status=400)
+    
+    # Баланс ограничивает всю серию, поэтому читается из БД
+    user = await hot.fresh_user(user_id)
+    if not user:
+        return web.json_response({'error': 'Insufficient balance'}, status=400)
+    
+    # Нонсы выдаются на всю серию; при досрочной остановке остаток пропускается
+    rngs = await rng.next_bets(user_id, len(bets))
+    try:
+        results, net, required = play_batch(
+            game_type, bets, user.balance, rngs,
+            stop_loss=stop_loss, take_profit=take_profit
+        )
+    except ValueError:
+        return web.json_response({'error': 'Unknown game'}, status=400)
+    
+    if not results:
+        return web.json_response({'error': 'Insufficient balance'}, status=400)
+    
+    # Сводные строки журнала: одна на выигрыши и одна на проигрыши
+    wins = [r for r in results if r['win']]
+    losses = [r for r in results if not r['win']]
+    nonces = f"nonce {results[0]['nonce']}-{results[-1]['nonce']}"
+    rows = []
+    if wins:
+        rows.append((
+            sum(r['amount'] - r['bet'] for r in wins),
+            "game_win",
+            f"Выигрыши в {game_type}: {len(wins)} ставок ({nonces})",
+            len(wins)
+        ))
+    if losses:
+        rows.append((
+            -sum(r['bet'] for r in losses),
+            "game_lose",
+            f"Проигрыши в {game_type}: {len(losses)} ставок ({nonces})",
+            len(losses)
+        ))
+    
+    new_balance = await db.settle_bets(user_id, rows, required)
+    if new_balance is None:
+        hot.table.invalidate(user_id)
+        return web.json_response({'error': 'Insufficient balance'}, status=400)
+    
+    return web.json_response({
+        'results': [
+            {
+                'bet': format_stars(r['bet']),
+                'win': r['win'],
+                'multiplier': r['multiplier'],
+                'amount': format_stars(r['amount']),
+                'nonce': r['nonce']
+            }
+            for r in results
+        ],
+        'net': format_stars(net),
+        'new_balance': format_stars(new_balance)
+    })
+
+async def fair_info(request):
+    """Хеш активного серверного сида, клиентский сид и следующий нонс"""
+    rng = request.app[RNG]
+    user_id = request.cookies.get('user_id')
+    if not user_id:
+        return web.json_response({'error': 'Not authorized'}, status=401)
+    return web.json_response(await rng.info(int(user_id)))
+
+async def fair_rotate(request):
+    """Раскрытие серверного сида и смена сидов"""
+    rng = request.app[RNG]
+    user_id = request.cookies.get('user_id')
+    if not user_id:
+        return web.json_response({'error': 'Not authorized'}, status=401)
+    data = await request.json()
+    return web.json_response(await rng.rotate(int(user_id), data.get('client_seed')))
+
+async def fair_verify(request):
+    """Повтор исхода ставки по раскрытому серверному сиду"""
+    data = await request.json()
+    try:
+        result = verify_round(
+            data['server_seed'],
+            data['client_seed'],
+            int(data['nonce']),
+            data['game'],
+            from_stars(data.get('bet', 1))
+        )
+    except (KeyError, ValueError):
+        return web.json_response({'error': 'Invalid request'}, status=400)
+    return web.json_response({**result, 'amount': format_stars(result['amount'])})
+
+async def events_stream(request):
+    """SSE: изменения баланса и уведомления для открытой страницы игр"""
+    hub = request.app[HUB]
+    user_id = request.cookies.get('user_id')
+    if not user_id:
+        return web.json_response({'error': 'Not authorized'}, status=401)
+    
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
+    await response.prepare(request)
+    
+    with hub.subscribe(int(user_id)) as queue:
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), Config.EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+            await response.write(f"data: {message}\n\n".encode())
 
 async def admin_action(request):
+    db = request.app[DB]
+    fraud = request.app[FRAUD]
     user_id = request.cookies.get('user_id')
     if not user_id or int(user_id) != Config.ADMIN_ID:
         return web.json_response({'error': 'Access denied'}, status=403)
@@ -217,10 +375,25 @@ async def admin_action(request):
         return web.json_response({'success': True})
     
     elif action == 'update_withdrawal':
-        await db.update_withdrawal_status(
+        if data['status'] not in WITHDRAWAL_STATUSES:
+            return web.json_response({'error': 'Unknown status'}, status=400)
+        updated = await db.update_withdrawal_status(
             int(data['withdrawal_id']),
             data['status']
         )
+        return web.json_response({'success': updated})
+    
+    elif action == 'bulk_withdrawals':
+        if data['status'] not in WITHDRAWAL_STATUSES:
+            return web.json_response({'error': 'Unknown status'}, status=400)
+        updated = await db.set_withdrawals_status(
+            [int(i) for i in data['withdrawal_ids']],
+            data['status']
+        )
+        return web.json_response({'success': True, 'updated': updated})
+    
+    elif action == 'unflag_user':
+        await fraud.unflag(int(data['user_id']))
         return web.json_response({'success': True})
     
     elif action == 'broadcast':
@@ -235,8 +408,37 @@ async def logout_handler(request):
     response.del_cookie('username')
     return response
 
-async def init_app():
+def setup_services(app: web.Application, db: StorageBackend = None):
+    """Хранилище и его подписчики: антифрод, SSE-хаб, горячее состояние, ГСЧ"""
+    db = db or create_database()
+    fraud = FraudMonitor(db)
+    db.subscribe(fraud.observe)
+    hub = EventHub()
+    db.subscribe(hub.on_ledger)
+    hot = HotState(db)
+    db.subscribe(hot.on_ledger)
+    
+    app[DB] = db
+    app[FRAUD] = fraud
+    app[HUB] = hub
+    app[HOT] = hot
+    app[RNG] = FairRng(db)
+
+async def on_startup(app):
+    await app[DB].init_db()
+    app[HOT].load(os.path.join(Config.STATE_DIR, "web.state"))
+    app[EVENTS_SYNC] = asyncio.create_task(app[HUB].run(app[DB]))
+
+async def on_cleanup(app):
+    app[EVENTS_SYNC].cancel()
+    app[HOT].save(os.path.join(Config.STATE_DIR, "web.state"))
+    await app[DB].close()
+
+async def init_app(db: StorageBackend = None):
     app = web.Application()
+    setup_services(app, db)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
     
     # Настройка Jinja2
     aiohttp_jinja2.setup(
@@ -251,6 +453,11 @@ async def init_app():
     app.router.add_get('/profile', profile_page)
     app.router.add_get('/admin', admin_page)
     app.router.add_post('/api/play', play_game)
+    app.router.add_post('/api/play/batch', play_batch_game)
+    app.router.add_get('/api/events', events_stream)
+    app.router.add_get('/api/fair', fair_info)
+    app.router.add_post('/api/fair/rotate', fair_rotate)
+    app.router.add_post('/api/fair/verify', fair_verify)
     app.router.add_post('/api/admin', admin_action)
     app.router.add_get('/logout', logout_handler)
     